@@ -0,0 +1,86 @@
+"""Время открытия списков админки на большом наборе данных.
+
+Запуск из корня репозитория:
+
+    python benchmarks/admin.py --posts 1000000 --json admin.json
+
+Сценарии открывают списки сообщений, комментариев и подписок,
+дальние страницы, фильтр по дате и поиск от имени суперпользователя.
+"""
+import argparse
+import logging
+import random
+
+from common import environment, seed, setup, write_json
+from routes import run
+
+
+def targets(rng):
+    from posts.dataset import WORDS
+    from posts.models import User
+
+    usernames = list(User.objects.order_by('?').values_list(
+        'username', flat=True
+    )[:50])
+
+    return {
+        'posts': lambda: ('get', '/admin/posts/post/', {}),
+        'posts_page_50': lambda: ('get', '/admin/posts/post/', {'p': 50}),
+        'posts_by_date': lambda: (
+            'get', '/admin/posts/post/',
+            {'pub_date__gte': '2000-01-01T00:00:00+00:00'}
+        ),
+        'posts_search': lambda: (
+            'get', '/admin/posts/post/', {'q': rng.choice(WORDS)}
+        ),
+        'comments': lambda: ('get', '/admin/posts/comment/', {}),
+        'comments_search': lambda: (
+            'get', '/admin/posts/comment/', {'q': rng.choice(WORDS)}
+        ),
+        'follows_search': lambda: (
+            'get', '/admin/posts/follow/', {'q': rng.choice(usernames)}
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--db', help='файл базы, по умолчанию BENCH_DB')
+    parser.add_argument('--requests', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    setup(args.db)
+    seed(args.posts)
+    logging.getLogger('core.middleware').setLevel(logging.ERROR)
+    from django.test import Client
+    from posts.models import Post, User
+
+    admin, _ = User.objects.get_or_create(
+        username='bench_admin',
+        defaults={'is_staff': True, 'is_superuser': True}
+    )
+    client = Client()
+    client.force_login(admin)
+    results = {}
+    for name, target in targets(random.Random(0)).items():
+        results[name] = run(
+            name, target, client, args.requests, args.warmup, False
+        )
+        row = results[name]
+        print(
+            f'{name:17} p50 {row["p50"]:8.2f}  p95 {row["p95"]:8.2f}  '
+            f'queries {row["queries_mean"]:5.1f}'
+        )
+    if args.json:
+        write_json(args.json, {
+            'environment': environment(),
+            'dataset': {'posts': Post.objects.count()},
+            'results': results,
+        })
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,328 @@
+"""Сравнение WSGI и ASGI при большом числе одновременных клиентов.
+
+Запуск из корня репозитория:
+
+    python benchmarks/asgi.py --posts 20000 --concurrency 100
+    python benchmarks/asgi.py --listeners 8 --json asgi.json
+
+Каждый сервер работает в отдельном процессе с одинаковым числом
+потоков --threads: WSGI - wsgiref с пулом потоков, ASGI - простой
+HTTP-сервер на asyncio с core.asgi.ASGIHandler. Нагрузку дает этот
+процесс: --concurrency клиентов по кругу открывают страницы чтения
+(лента, группа, профиль, сообщение), заголовки запроса приходят с
+задержкой --slow мс, как из медленной сети, а --listeners клиентов
+держат открытой живую ленту. Серверы из пакетов не нужны.
+
+Медленные заголовки сами по себе WSGI почти не вредят: клиент
+успевает их дослать, пока запрос ждет свободный поток. Разницу дают
+долгие соединения: каждая лента под WSGI занимает поток целиком.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import unquote
+
+from common import environment, percentiles, seed, setup, write_json
+
+HOST = '127.0.0.1'
+READ_SCENARIOS = ('index', 'group', 'profile', 'post_detail')
+
+
+def wsgi_server(port, threads):
+    """wsgiref, который обслуживает соединения пулом из threads потоков"""
+    from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+    from django.core.wsgi import get_wsgi_application
+
+    class Handler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    class PooledWSGIServer(WSGIServer):
+        request_queue_size = 1024
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.pool = ThreadPoolExecutor(max_workers=threads)
+
+        def process_request(self, request, client_address):
+            self.pool.submit(self.process_in_thread, request, client_address)
+
+        def process_in_thread(self, request, client_address):
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    server = PooledWSGIServer((HOST, port), Handler)
+    server.set_app(get_wsgi_application())
+    server.serve_forever()
+
+
+async def asgi_connection(app, port, reader, writer):
+    """Один запрос HTTP/1.1 с Connection: close"""
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+        writer.close()
+        return
+    lines = head.decode('latin-1').split('\r\n')
+    method, target, version = lines[0].split(' ')
+    headers = [
+        tuple(part.strip().encode('latin-1') for part in line.split(':', 1))
+        for line in lines[1:] if ':' in line
+    ]
+    length = int(dict(headers).get(b'content-length', 0))
+    body = await reader.readexactly(length) if length else b''
+    path, _, query = target.partition('?')
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': version.split('/')[1],
+        'method': method,
+        'scheme': 'http',
+        'path': unquote(path),
+        'raw_path': path.encode('latin-1'),
+        'query_string': query.encode('latin-1'),
+        'root_path': '',
+        'headers': [(name.lower(), value) for name, value in headers],
+        'client': writer.get_extra_info('peername')[:2],
+        'server': (HOST, port),
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await reader.read()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            writer.write(
+                f'HTTP/1.1 {status} {HTTPStatus(status).phrase}\r\n'
+                .encode()
+            )
+            for name, value in message['headers']:
+                writer.write(name + b': ' + value + b'\r\n')
+            writer.write(b'Connection: close\r\n\r\n')
+        else:
+            writer.write(message.get('body', b''))
+        await writer.drain()
+
+    try:
+        await app(scope, receive, send)
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+def asgi_server(port, threads):
+    from core.asgi import ASGIHandler
+
+    app = ASGIHandler(threads=threads)
+
+    async def main():
+        server = await asyncio.start_server(
+            lambda reader, writer: asgi_connection(
+                app, port, reader, writer
+            ),
+            HOST, port, backlog=1024
+        )
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+async def request(port, path, slow):
+    reader, writer = await asyncio.open_connection(HOST, port)
+    try:
+        writer.write(f'GET {path} HTTP/1.1\r\n'.encode())
+        if slow:
+            await writer.drain()
+            await asyncio.sleep(slow / 1000)
+        writer.write(b'Host: localhost\r\nConnection: close\r\n\r\n')
+        return await reader.read()
+    finally:
+        writer.close()
+
+
+async def fetch(port, path, slow, timeout):
+    """Время ответа в мс и код, 0 - ошибка или нет ответа за timeout"""
+    start = time.perf_counter()
+    try:
+        data = await asyncio.wait_for(request(port, path, slow), timeout)
+    except (OSError, asyncio.TimeoutError):
+        data = b''
+    status = int(data.split(b' ', 2)[1]) if data else 0
+    return (time.perf_counter() - start) * 1000, status
+
+
+async def listen(port, stop):
+    """Держим открытой живую ленту до stop"""
+    try:
+        reader, writer = await asyncio.open_connection(HOST, port)
+    except OSError:
+        return
+    writer.write(
+        b'GET /live/ HTTP/1.1\r\nHost: localhost\r\n'
+        b'Accept: text/event-stream\r\n\r\n'
+    )
+    while not stop.is_set():
+        try:
+            chunk = await asyncio.wait_for(reader.read(4096), 0.5)
+        except asyncio.TimeoutError:
+            continue
+        if not chunk:
+            break
+    writer.close()
+
+
+async def load(port, paths, concurrency, duration, slow, listeners,
+               timeout):
+    stop = asyncio.Event()
+    holders = [
+        asyncio.ensure_future(listen(port, stop)) for _ in range(listeners)
+    ]
+    # Ленты подключаются раньше, чем начинается отсчет
+    await asyncio.sleep(0.5)
+    samples, statuses = [], {}
+    deadline = time.perf_counter() + duration
+    rng = random.Random(0)
+
+    async def client():
+        while time.perf_counter() < deadline:
+            elapsed, status = await fetch(
+                port, rng.choice(paths), slow, timeout
+            )
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == 200:
+                samples.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    total = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*holders)
+    result = percentiles(samples) if len(samples) > 1 else {}
+    result.update({
+        'rps': round(len(samples) / total, 1),
+        'ok': len(samples),
+        'statuses': {str(code): count for code, count in statuses.items()},
+    })
+    return result
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        with socket.socket() as probe:
+            if probe.connect_ex((HOST, port)) == 0:
+                return
+        time.sleep(0.1)
+    raise RuntimeError(f'server on {port} did not start')
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind((HOST, 0))
+        return probe.getsockname()[1]
+
+
+def run_server(kind, args):
+    """Процесс с сервером kind, возвращаем его и порт"""
+    port = free_port()
+    command = [
+        sys.executable, os.path.abspath(__file__), '--serve', kind,
+        '--port', str(port), '--threads', str(args.threads),
+    ]
+    server = subprocess.Popen(command, env=os.environ.copy())
+    wait_for_port(port)
+    return server, port
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--db', help='файл базы, по умолчанию BENCH_DB')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument(
+        '--slow', type=float, default=50,
+        help='задержка между частями заголовков, мс'
+    )
+    parser.add_argument(
+        '--listeners', type=int, default=0,
+        help='клиентов с открытой живой лентой'
+    )
+    parser.add_argument(
+        '--timeout', type=float, default=5,
+        help='сколько ждать ответа, с; дольше - ошибка'
+    )
+    parser.add_argument('--json', help='куда сохранить результаты')
+    parser.add_argument('--serve', choices=('wsgi', 'asgi'))
+    parser.add_argument('--port', type=int)
+    args = parser.parse_args()
+
+    setup(args.db)
+    logging.getLogger('core.middleware').setLevel(logging.ERROR)
+    logging.getLogger('django.request').setLevel(logging.ERROR)
+    if args.serve:
+        server = wsgi_server if args.serve == 'wsgi' else asgi_server
+        return server(args.port, args.threads)
+
+    seed(args.posts)
+    from routes import targets
+
+    _, scenarios = targets(random.Random(0))
+    paths = [
+        scenarios[name]()[1]
+        for name in READ_SCENARIOS
+        for _ in range(50)
+    ]
+    results = {}
+    for kind in ('wsgi', 'asgi'):
+        server, port = run_server(kind, args)
+        try:
+            results[kind] = asyncio.run(load(
+                port, paths, args.concurrency, args.duration, args.slow,
+                args.listeners, args.timeout
+            ))
+        finally:
+            server.terminate()
+            server.wait()
+        row = results[kind]
+        print(
+            f'{kind}  {row["rps"]:7.1f} rps  '
+            f'p50 {row.get("p50", 0):8.1f}  p95 {row.get("p95", 0):8.1f}  '
+            f'p99 {row.get("p99", 0):8.1f} ms  statuses {row["statuses"]}'
+        )
+    if args.json:
+        write_json(args.json, {
+            'environment': environment(),
+            'options': {
+                key: getattr(args, key) for key in (
+                    'posts', 'threads', 'concurrency', 'duration', 'slow',
+                    'listeners', 'timeout'
+                )
+            },
+            'results': results,
+        })
+
+
+if __name__ == '__main__':
+    main()
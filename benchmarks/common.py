@@ -0,0 +1,112 @@
+"""Общая подготовка для сценариев из benchmarks/.
+
+Сценарии работают с отдельной базой BENCH_DB (по умолчанию
+yatube/bench.sqlite3), рабочая база проекта не затрагивается.
+"""
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, 'yatube')]
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+
+def setup(db=None):
+    if db:
+        os.environ['BENCH_DB'] = os.path.abspath(db)
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def timed(func, repeat):
+    """Медиана и максимум времени вызова func в миллисекундах"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples), max(samples)
+
+
+def percentiles(samples):
+    """p50/p95/p99, среднее и максимум выборки в миллисекундах"""
+    cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {
+        'p50': round(cuts[49], 3),
+        'p95': round(cuts[94], 3),
+        'p99': round(cuts[98], 3),
+        'mean': round(statistics.fmean(samples), 3),
+        'max': round(max(samples), 3),
+    }
+
+
+def rss_mb():
+    """Текущий размер резидентной памяти процесса"""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * resource.getpagesize() / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def environment():
+    """Описание запуска для сравнения результатов между коммитами"""
+    import django
+
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'machine': platform.machine(),
+    }
+
+
+def write_json(path, data):
+    with open(path, 'w') as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+
+
+def regressions(old, new, metric, tolerance):
+    """Сценарии, где metric вырос больше чем в 1 + tolerance раз"""
+    found = {}
+    for name, result in new.items():
+        before = old.get(name, {}).get(metric)
+        if before and result[metric] > before * (1 + tolerance):
+            found[name] = (before, result[metric])
+    return found
+
+
+def seed(posts):
+    """Наполняем базу, если в ней меньше posts сообщений"""
+    from posts.dataset import generate
+    from posts.models import Post
+
+    missing = posts - Post.objects.count()
+    if missing > 0:
+        generate(
+            users=max(missing // 100, 10),
+            groups=max(missing // 10000, 5),
+            posts=missing,
+            comments=missing,
+            follows=10,
+            images=0,
+            seed=posts,
+            log=print,
+        )
@@ -0,0 +1,97 @@
+"""Планы и время горячих запросов без составных индексов и с ними.
+
+Запуск из корня репозитория:
+
+    python benchmarks/indexes.py --posts 1000000
+
+База наполняется один раз и переиспользуется следующими запусками.
+"""
+import argparse
+import json
+
+from common import seed, setup, timed
+
+
+def shapes():
+    """Запросы в том виде, в каком их строят представления"""
+    from posts.models import Post, Group, User, Comment, Follow
+    from posts.paginators import CursorPaginator
+
+    def page(queryset, key='pub_date'):
+        return CursorPaginator(queryset, 10, key=key).ordered()[:11]
+
+    posts = Post.objects.select_related('author', 'group')
+    author = User.objects.order_by('pk').first()
+    group = Group.objects.order_by('pk').first()
+    post = Post.objects.order_by('-comments_count').first()
+    middle = Post.objects.order_by('-pub_date')[Post.objects.count() // 2]
+    return {
+        'index': page(posts),
+        'index_deep_cursor': page(
+            posts.filter(pub_date__lt=middle.pub_date)
+        ),
+        'group': page(posts.filter(group=group)),
+        'profile': page(posts.filter(author=author)),
+        'post_comments': page(
+            Comment.objects.select_related('author').filter(post=post),
+            key='created'
+        ),
+        'following': Follow.objects.filter(
+            author=author
+        ).values_list('user_id', flat=True),
+    }
+
+
+def toggle(create):
+    """Удаляем или возвращаем индексы из Meta.indexes"""
+    from django.db import connection
+    from posts.models import Post, Comment, Follow
+
+    with connection.schema_editor() as editor:
+        for model in (Post, Comment, Follow):
+            for index in model._meta.indexes:
+                if create:
+                    editor.add_index(model, index)
+                else:
+                    editor.remove_index(model, index)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def measure(repeat):
+    result = {}
+    for name, queryset in shapes().items():
+        median, worst = timed(lambda: list(queryset.all()), repeat)
+        plan = queryset.explain()
+        print(f'{name}: median {median:.2f} ms, max {worst:.2f} ms')
+        print('    ' + plan.replace('\n', '\n    '))
+        result[name] = {'median_ms': median, 'max_ms': worst, 'plan': plan}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--posts', type=int, default=1000000)
+    parser.add_argument('--db', help='файл базы, по умолчанию BENCH_DB')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    setup(args.db)
+    seed(args.posts)
+    report = {}
+    print('== без индексов')
+    toggle(create=False)
+    try:
+        report['before'] = measure(args.repeat)
+    finally:
+        toggle(create=True)
+    print('== с индексами')
+    report['after'] = measure(args.repeat)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""Нагрузочный прогон страниц posts через WSGI-обработчик в процессе.
+
+Запуск из корня репозитория:
+
+    python benchmarks/routes.py --posts 100000 --json after.json
+    python benchmarks/routes.py --compare before.json --json after.json
+
+Для каждого сценария считаются p50/p95/p99 времени ответа, число
+запросов к БД и размер памяти процесса. При --compare процесс
+завершается с кодом 1, если p95 вырос больше допуска или запросов
+к БД стало больше.
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+
+from common import (
+    environment, percentiles, regressions, rss_mb, seed, setup, write_json
+)
+
+
+def targets(rng):
+    """Случайные, но реалистичные адреса: популярное чаще"""
+    from posts.dataset import WORDS
+    from posts.models import Post, Group, UserStats
+
+    groups = list(Group.objects.order_by('-posts_count').values_list(
+        'slug', flat=True
+    )[:50])
+    authors = list(UserStats.objects.order_by('-posts_count').values_list(
+        'user__username', flat=True
+    )[:50])
+    last = Post.objects.order_by('-pk').values_list('pk', flat=True)[0]
+    first = max(last - 10000, 1)
+    reader = UserStats.objects.order_by('-following_count').values_list(
+        'user_id', flat=True
+    )[0]
+
+    def post_id():
+        return rng.randint(first, last)
+
+    return reader, {
+        'index': lambda: ('get', '/', {}),
+        'index_page_5': lambda: ('get', '/', {'page': 5}),
+        'group': lambda: ('get', f'/group/{rng.choice(groups)}/', {}),
+        'profile': lambda: ('get', f'/profile/{rng.choice(authors)}/', {}),
+        'post_detail': lambda: ('get', f'/posts/{post_id()}/', {}),
+        'post_comments': lambda: (
+            'get', f'/posts/{post_id()}/comments/', {}
+        ),
+        'follow': lambda: ('get', '/follow/', {}),
+        'search': lambda: (
+            'get', '/search/', {'q': ' '.join(rng.sample(WORDS, 2))}
+        ),
+        'api_index': lambda: ('get', '/api/v1/posts/', {}),
+        'api_index_sparse': lambda: (
+            'get', '/api/v1/posts/', {'fields': 'id,pub_date,author'}
+        ),
+        'api_group': lambda: (
+            'get', f'/api/v1/groups/{rng.choice(groups)}/posts/',
+            {'embed': 'author'}
+        ),
+        'api_post_detail': lambda: ('get', f'/api/v1/posts/{post_id()}/', {}),
+        'post_create': lambda: (
+            'post', '/create/', {'text': f'Нагрузка {rng.random()}'}
+        ),
+        'add_comment': lambda: (
+            'post', f'/posts/{post_id()}/comment/', {'text': 'Нагрузка'}
+        ),
+    }
+
+
+def run(name, target, client, requests, warmup, cold):
+    from django.core.cache import cache
+    from core.middleware import QueryCounter
+
+    samples, queries = [], []
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    for i in range(warmup + requests):
+        method, url, data = target()
+        if cold:
+            cache.clear()
+        with QueryCounter() as counter:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            elapsed = (time.perf_counter() - start) * 1000
+        if response.status_code not in (200, 302):
+            raise RuntimeError(f'{name}: {url} -> {response.status_code}')
+        if i >= warmup:
+            samples.append(elapsed)
+            queries.append(counter.count)
+    total = time.perf_counter() - started
+    result = percentiles(samples)
+    result.update({
+        'requests': requests,
+        'rps': round((warmup + requests) / total, 1),
+        'queries_mean': round(sum(queries) / len(queries), 2),
+        'queries_max': max(queries),
+        'rss_mb': round(rss_mb(), 1),
+        'rss_growth_mb': round(rss_mb() - rss_before, 1),
+    })
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--posts', type=int, default=100000)
+    parser.add_argument('--db', help='файл базы, по умолчанию BENCH_DB')
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument(
+        '--only', nargs='+', help='запустить только эти сценарии'
+    )
+    parser.add_argument(
+        '--cold', action='store_true', help='очищать кэш перед запросом'
+    )
+    parser.add_argument('--json', help='куда сохранить результаты')
+    parser.add_argument('--compare', help='результаты прошлого прогона')
+    parser.add_argument(
+        '--tolerance', type=float, default=0.25,
+        help='допустимый рост p95, доля'
+    )
+    args = parser.parse_args()
+
+    setup(args.db)
+    seed(args.posts)
+    # Превышения бюджета и так видны в отчете
+    logging.getLogger('core.middleware').setLevel(logging.ERROR)
+    from django.test import Client
+    from posts.models import Post, User
+
+    rng = random.Random(0)
+    reader, scenarios = targets(rng)
+    client = Client()
+    client.force_login(User.objects.get(pk=reader))
+    results = {}
+    for name, target in scenarios.items():
+        if args.only and name not in args.only:
+            continue
+        results[name] = run(
+            name, target, client, args.requests, args.warmup, args.cold
+        )
+        row = results[name]
+        print(
+            f'{name:14} p50 {row["p50"]:8.2f}  p95 {row["p95"]:8.2f}  '
+            f'p99 {row["p99"]:8.2f} ms  {row["rps"]:7.1f} rps  '
+            f'queries {row["queries_mean"]:5.1f}  rss {row["rss_mb"]} MB'
+        )
+    report = {
+        'environment': environment(),
+        'dataset': {'posts': Post.objects.count()},
+        'options': {'requests': args.requests, 'cold': args.cold},
+        'results': results,
+    }
+    if args.json:
+        write_json(args.json, report)
+    if args.compare:
+        with open(args.compare) as file:
+            old = json.load(file)['results']
+        failed = False
+        for metric, tolerance in (('p95', args.tolerance),
+                                  ('queries_max', 0)):
+            found = regressions(old, results, metric, tolerance)
+            for name, (before, after) in found.items():
+                print(f'REGRESSION {name} {metric}: {before} -> {after}')
+                failed = True
+        if failed:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
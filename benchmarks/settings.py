@@ -0,0 +1,15 @@
+import os
+
+from yatube.settings import *  # noqa: F401,F403
+from yatube.settings import BASE_DIR
+
+DEBUG = False
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.environ.get(
+            'BENCH_DB', os.path.join(BASE_DIR, 'bench.sqlite3')
+        ),
+    }
+}
@@ -0,0 +1,169 @@
+"""Читатели и писатели SQLite одновременно: профиль Django и WAL.
+
+Запуск из корня репозитория:
+
+    python benchmarks/sqlite.py --posts 20000 --readers 8 --writers 2
+    python benchmarks/sqlite.py --duration 20 --json sqlite.json
+
+Для каждого профиля база BENCH_DB копируется во временный файл, и
+--readers процессов читают ленту и сообщения с комментариями, пока
+--writers процессов добавляют комментарии и сообщения через ORM, со
+всеми сигналами. Профиль default - журнал DELETE и только таймаут
+драйвера, tuned - SQLITE_PRAGMAS из настроек. Считаются операции в
+секунду, задержки и ошибки "database is locked".
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from common import environment, percentiles, seed, setup, write_json
+
+PROFILES = ('default', 'tuned')
+
+
+def read(rng, top):
+    from posts.models import Comment, Post
+
+    if rng.random() < 0.5:
+        return list(
+            Post.objects.select_related('author', 'group')
+            .order_by('-pub_date', '-pk')[:10]
+        )
+    post = Post.objects.select_related('author', 'group').filter(
+        pk=rng.randint(1, top)
+    ).first()
+    return post and list(
+        Comment.objects.filter(post=post).select_related('author')[:20]
+    )
+
+
+def write(rng, top, users):
+    from posts.models import Comment, Post
+
+    author_id = rng.choice(users)
+    if rng.random() < 0.2:
+        return Post.objects.create(
+            author_id=author_id, text=f'bench {rng.random()}'
+        )
+    return Comment.objects.create(
+        post_id=rng.randint(1, top), author_id=author_id,
+        text=f'bench {rng.random()}'
+    )
+
+
+def worker(role, number, path, pragmas, duration, results):
+    """Один процесс: своя база и PRAGMA, операции до конца срока"""
+    from django.conf import settings
+    from django.db import OperationalError, connection
+
+    from posts.models import Post, User
+
+    connection.settings_dict['NAME'] = path
+    settings.SQLITE_PRAGMAS = pragmas
+    rng = random.Random(f'{role}{number}')
+    top = Post.objects.order_by('-pk').values_list('pk', flat=True)[0]
+    users = list(User.objects.values_list('pk', flat=True)[:1000])
+    samples, errors = [], 0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            if role == 'read':
+                read(rng, top)
+            else:
+                write(rng, top, users)
+        except OperationalError:
+            errors += 1
+            continue
+        samples.append((time.perf_counter() - start) * 1000)
+    results.put((role, samples, errors))
+
+
+def run(profile, source, args):
+    """Копия базы, процессы читателей и писателей, сводка по ролям"""
+    from django.conf import settings
+
+    pragmas = dict(settings.SQLITE_PRAGMAS) if profile == 'tuned' else {
+        'journal_mode': 'DELETE',
+    }
+    directory = tempfile.mkdtemp(prefix='bench-sqlite-')
+    path = os.path.join(directory, 'db.sqlite3')
+    shutil.copy(source, path)
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    roles = ['read'] * args.readers + ['write'] * args.writers
+    processes = [
+        context.Process(target=worker, args=(
+            role, number, path, pragmas, args.duration, results
+        ))
+        for number, role in enumerate(roles)
+    ]
+    try:
+        for process in processes:
+            process.start()
+        collected = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    summary = {}
+    for role in ('read', 'write'):
+        samples = [
+            sample for kind, part, _ in collected if kind == role
+            for sample in part
+        ]
+        row = percentiles(samples) if len(samples) > 1 else {}
+        row.update({
+            'ops': round(len(samples) / args.duration, 1),
+            'errors': sum(
+                errors for kind, _, errors in collected if kind == role
+            ),
+        })
+        summary[role] = row
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--db', help='файл базы, по умолчанию BENCH_DB')
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--json', help='куда сохранить результаты')
+    args = parser.parse_args()
+
+    setup(args.db)
+    seed(args.posts)
+    from django.db import connection, connections
+
+    source = connection.settings_dict['NAME']
+    # Копируем базу без открытых соединений: WAL уже перенесен в файл
+    connections.close_all()
+    results = {}
+    for profile in PROFILES:
+        results[profile] = run(profile, source, args)
+        for role, row in results[profile].items():
+            print(
+                f'{profile:8} {role:5} {row["ops"]:8.1f} ops/s  '
+                f'p50 {row.get("p50", 0):8.1f}  p95 {row.get("p95", 0):8.1f}'
+                f'  p99 {row.get("p99", 0):8.1f} ms  errors {row["errors"]}'
+            )
+    if args.json:
+        write_json(args.json, {
+            'environment': environment(),
+            'options': {
+                key: getattr(args, key) for key in (
+                    'posts', 'readers', 'writers', 'duration'
+                )
+            },
+            'results': results,
+        })
+
+
+if __name__ == '__main__':
+    main()
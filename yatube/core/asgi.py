@@ -0,0 +1,223 @@
+"""ASGI-приложение для Django 2.2.
+
+В Django до 3.0 нет ASGI и асинхронных view, поэтому обработчик
+переводит соединение ASGI в окружение WSGI и выполняет обычный
+WSGIHandler в пуле из ASGI_THREADS потоков. Цикл событий сам читает
+тело запроса и отдает ответ: медленный клиент не держит поток, поток
+занят только работой view и БД. Если потоки заняты и в очереди уже
+ASGI_MAX_PENDING запросов, новые получают 503 без ожидания.
+
+Потоковый ответ с атрибутом async_content (функция, возвращающая
+асинхронный итератор) отдается из цикла событий: так живая лента
+держит соединение без потока. Запросы отмечены ключом ASGI в
+окружении: под WSGI живая лента выключена, соединение заняло бы поток.
+"""
+import asyncio
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import suppress
+
+from django.conf import settings as s
+from django.core.handlers.wsgi import WSGIHandler
+
+ASGI = 'yatube.asgi'
+SERVICE_UNAVAILABLE = [(b'content-type', b'text/plain; charset=utf-8')]
+
+
+def wsgi_string(value):
+    return value.encode().decode('latin-1')
+
+
+def environ(scope, body):
+    """Окружение WSGI для HTTP-запроса ASGI"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    result = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': wsgi_string(scope.get('root_path', '')),
+        'PATH_INFO': wsgi_string(scope['path']),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1] or 80),
+        'REMOTE_ADDR': client[0],
+        'SERVER_PROTOCOL': f'HTTP/{scope.get("http_version", "1.1")}',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+        ASGI: True,
+    }
+    for name, value in scope.get('headers', ()):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f'HTTP_{name}'
+        if name in result:
+            value = f'{result[name]},{value}'
+        result[name] = value
+    return result
+
+
+class ASGIHandler:
+    """ASGI 3: запрос в пуле потоков, ввод-вывод в цикле событий"""
+
+    def __init__(self, threads=None, max_pending=None):
+        self.wsgi = WSGIHandler()
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads or s.ASGI_THREADS,
+            thread_name_prefix='asgi'
+        )
+        self.max_pending = max_pending or s.ASGI_MAX_PENDING
+        self.pending = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+        if scope['type'] != 'http':
+            raise ValueError(f'Unsupported scope: {scope["type"]}')
+        if self.pending >= self.max_pending:
+            return await self.reject(send)
+        self.pending += 1
+        try:
+            body = await self.read_body(receive)
+            status, headers, response = await self.run(
+                self.handle, environ(scope, body)
+            )
+        finally:
+            # Отдача ответа, в том числе бесконечного, потоки не ждет
+            self.pending -= 1
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': headers,
+        })
+        await self.send_body(response, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def reject(self, send):
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': SERVICE_UNAVAILABLE + [(b'retry-after', b'1')],
+        })
+        await send({'type': 'http.response.body', 'body': b'Busy'})
+
+    async def read_body(self, receive):
+        """Тело запроса в файл, в памяти - до FILE_UPLOAD_MAX_MEMORY_SIZE"""
+        body = tempfile.SpooledTemporaryFile(
+            max_size=s.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            body.write(message.get('body', b''))
+            if not message.get('more_body'):
+                break
+        body.seek(0)
+        return body
+
+    async def run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, func, *args
+        )
+
+    def handle(self, environ):
+        """Ответ Django; обычный ответ закрывается в том же потоке"""
+        started = []
+        response = self.wsgi(
+            environ, lambda status, headers: started.append((
+                status, headers
+            ))
+        )
+        status, headers = started[0]
+        headers = [
+            (name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers
+        ]
+        if not response.streaming:
+            content = response.content
+            response.close()
+            response = content
+        elif hasattr(response, 'async_content'):
+            content = response.async_content
+            response.close()
+            response = content()
+        return int(status.split()[0]), headers, response
+
+    async def send_body(self, response, receive, send):
+        if isinstance(response, bytes):
+            await send({'type': 'http.response.body', 'body': response})
+            return
+        try:
+            if hasattr(response, '__aiter__'):
+                await self.send_async(response, receive, send)
+            else:
+                chunks = iter(response)
+                while True:
+                    chunk = await self.run(next, chunks, None)
+                    if chunk is None:
+                        break
+                    await send(self.chunk(chunk))
+        finally:
+            if hasattr(response, 'aclose'):
+                await response.aclose()
+            elif hasattr(response, 'close'):
+                await self.run(response.close)
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def send_async(self, response, receive, send):
+        """Асинхронный поток до конца или до отключения клиента"""
+        disconnected = asyncio.ensure_future(self.disconnect(receive))
+        chunks = response.__aiter__()
+        try:
+            while True:
+                step = asyncio.ensure_future(chunks.__anext__())
+                await asyncio.wait(
+                    (step, disconnected),
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if not step.done():
+                    step.cancel()
+                    with suppress(asyncio.CancelledError):
+                        await step
+                    return
+                try:
+                    chunk = step.result()
+                except StopAsyncIteration:
+                    return
+                await send(self.chunk(chunk))
+        finally:
+            disconnected.cancel()
+
+    @staticmethod
+    async def disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    @staticmethod
+    def chunk(data):
+        if isinstance(data, str):
+            data = data.encode()
+        return {'type': 'http.response.body', 'body': data,
+                'more_body': True}
+
+
+def get_asgi_application():
+    import django
+
+    django.setup(set_prefix=False)
+    return ASGIHandler()
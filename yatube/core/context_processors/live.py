@@ -0,0 +1,6 @@
+from core.asgi import ASGI
+
+
+def live(request):
+    """Живая лента только для запросов через ASGI"""
+    return {'live_stream': request.META.get(ASGI, False)}
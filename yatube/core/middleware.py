@@ -0,0 +1,123 @@
+import logging
+import time
+from contextlib import ExitStack
+
+from django.conf import settings as s
+from django.db import connections
+
+from core import routers
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    """Считает SQL-запросы и время их выполнения по всем базам"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.monotonic() - start
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for connection in connections.all():
+            self._stack.enter_context(connection.execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+
+
+def query_budget(view_name, method='GET'):
+    """Лимит запросов view, с SHARDS - из QUERY_BUDGET_SHARDS"""
+    key = (view_name, 'GET' if method == 'HEAD' else method)
+    if s.SHARDS and key in s.QUERY_BUDGET_SHARDS:
+        base, per_shard = s.QUERY_BUDGET_SHARDS[key]
+        return base + per_shard * len(s.SHARDS)
+    return s.QUERY_BUDGETS.get(key, s.QUERY_BUDGET_DEFAULT)
+
+
+class QueryBudgetMiddleware:
+    """Следит за числом запросов к БД и временем ответа каждого view.
+
+    Лимиты запросов задаются в QUERY_BUDGETS по имени view и методу
+    (запись стоит дороже чтения того же адреса), с SHARDS - в
+    QUERY_BUDGET_SHARDS как постоянная часть и доля каждого шарда,
+    время - в REQUEST_TIME_BUDGET. Превышение пишется в лог, а
+    превышение числа запросов при QUERY_BUDGET_RAISE поднимает
+    QueryBudgetExceeded: так в тестах, время ответа в них не
+    показательно.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.monotonic()
+        with QueryCounter() as counter:
+            response = self.get_response(request)
+        elapsed = time.monotonic() - start
+        match = request.resolver_match
+        if match is None:
+            return response
+        budget = query_budget(match.view_name, request.method)
+        over = counter.count > budget
+        if over or elapsed > s.REQUEST_TIME_BUDGET:
+            message = (
+                f'{request.method} {match.view_name}: {counter.count} queries '
+                f'(budget {budget}), {counter.duration:.3f}s in SQL, '
+                f'{elapsed:.3f}s total'
+            )
+            if over and s.QUERY_BUDGET_RAISE:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+class ReplicaMiddleware:
+    """Выбирает реплику для чтения и закрепляет писавших за default.
+
+    См. core.routers: реплика берется только для view из
+    DATABASE_REPLICA_VIEWS и только без cookie DATABASE_PIN_COOKIE.
+    Запись в любую базу, в том числе в шард, ставит эту cookie.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.start()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(
+                        connection.execute_wrapper(routers.watch)
+                    )
+                response = self.get_response(request)
+        finally:
+            wrote = routers.finish()
+        if wrote:
+            response.set_cookie(
+                s.DATABASE_PIN_COOKIE, '1', max_age=s.DATABASE_PIN_SECONDS,
+                httponly=True, samesite='Lax'
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (
+            s.DATABASE_REPLICAS
+            and request.resolver_match.view_name in s.DATABASE_REPLICA_VIEWS
+            and s.DATABASE_PIN_COOKIE not in request.COOKIES
+        ):
+            routers.start(routers.choose())
@@ -0,0 +1,65 @@
+"""Чтение с реплик, запись в основную базу.
+
+ReplicaMiddleware отмечает запросы к view из DATABASE_REPLICA_VIEWS,
+и их чтения ReplicaRouter отдает одной случайной реплике из
+DATABASE_REPLICAS. Все остальное, включая сессии и пользователей,
+читается из default, запись идет только туда. После записи ответ
+ставит cookie DATABASE_PIN_COOKIE на DATABASE_PIN_SECONDS секунд:
+пока она есть, браузер читает из default и видит свои изменения,
+даже если реплики отстают. Запись замечает watch по тексту SQL в
+любой базе: запись в шард решает ShardRouter, до этого роутера она
+не доходит.
+"""
+import random
+import threading
+
+from django.conf import settings as s
+from django.db import DEFAULT_DB_ALIAS
+
+# Вход и сессия не должны зависеть от отставания реплики
+PRIMARY_APPS = {'auth', 'sessions'}
+WRITES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_state = threading.local()
+
+
+def start(replica=None):
+    """Начало запроса: реплика для чтения или None - читать из default"""
+    _state.replica = replica
+    _state.wrote = False
+
+
+def finish():
+    """Конец запроса: была ли запись в базу"""
+    wrote = getattr(_state, 'wrote', False)
+    start()
+    return wrote
+
+
+def watch(execute, sql, params, many, context):
+    """execute_wrapper: отмечаем запись в любую базу"""
+    if sql.lstrip()[:7].upper().startswith(WRITES):
+        _state.wrote = True
+    return execute(sql, params, many, context)
+
+
+def choose():
+    return random.choice(s.DATABASE_REPLICAS)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        replica = getattr(_state, 'replica', None)
+        if replica and model._meta.app_label not in PRIMARY_APPS:
+            return replica
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Схему реплики получают вместе с данными
+        return db == DEFAULT_DB_ALIAS
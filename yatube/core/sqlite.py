@@ -0,0 +1,25 @@
+"""PRAGMA для каждого нового соединения SQLite.
+
+WAL дает читать во время записи, а synchronous=NORMAL в режиме WAL
+не рискует целостностью и снимает fsync с каждой фиксации. mmap_size
+и cache_size уменьшают чтения с диска, temp_store держит временные
+таблицы сортировок в памяти. busy_timeout заставляет соединение ждать
+занятую базу, а не сразу получать "database is locked". Значения
+берутся из SQLITE_PRAGMAS по порядку, ключ PRAGMAS в настройках
+базы дополняет их для нее одной.
+"""
+from django.conf import settings as s
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    # Мимо курсоров Django: PRAGMA не попадают в счетчики запросов
+    pragmas = {
+        **s.SQLITE_PRAGMAS, **connection.settings_dict.get('PRAGMAS', {})
+    }
+    for name, value in pragmas.items():
+        connection.connection.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,39 @@
+"""Загрузка картинок с ограниченной памятью.
+
+Обработчик пишет каждую загрузку во временный файл кусками по 64 КБ,
+без копии в памяти. validate_image отклоняет картинку по размеру
+файла и числу пикселей из заголовка, до того как миниатюры декодируют
+ее целиком. Объем самого запроса ограничивает веб-сервер перед Django.
+"""
+from django.conf import settings as s
+from django.core.exceptions import ValidationError
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+
+
+class StreamingUploadHandler(TemporaryFileUploadHandler):
+    """Любая загрузка, даже маленькая, пишется на диск кусками"""
+
+    chunk_size = 64 * 2 ** 10
+
+
+def validate_image(file):
+    """Размер файла и число пикселей по уже прочитанному заголовку.
+
+    forms.ImageField открывает загрузку через Image.open и verify,
+    это разбор заголовка и структуры без декодирования пикселей.
+    """
+    if file.size > s.UPLOAD_MAX_BYTES:
+        raise ValidationError(
+            'Файл больше %(limit)s МБ.',
+            code='too_large',
+            params={'limit': s.UPLOAD_MAX_BYTES // 2 ** 20},
+        )
+    image = getattr(file, 'image', None)
+    if image is not None and image.width * image.height > (
+        s.UPLOAD_MAX_PIXELS
+    ):
+        raise ValidationError(
+            'Картинка больше %(limit)s мегапикселей.',
+            code='too_many_pixels',
+            params={'limit': s.UPLOAD_MAX_PIXELS // 10 ** 6},
+        )
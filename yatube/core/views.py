@@ -1,4 +1,9 @@
+from django.conf import settings as s
 from django.shortcuts import render
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+
+from core.storage import is_hashed
 
 
 def page_not_found(request, exception):
@@ -15,3 +20,14 @@ def permission_denied(request, exception):
 
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
+
+
+def media(request, path, document_root=None):
+    """Отдача медиа при DEBUG: файлы с хешем в имени не меняются"""
+    response = serve(request, path, document_root=document_root)
+    if response.status_code == 200 and is_hashed(path):
+        patch_cache_control(
+            response, public=True, immutable=True,
+            max_age=s.MEDIA_IMMUTABLE_MAX_AGE
+        )
+    return response
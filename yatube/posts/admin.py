@@ -1,9 +1,66 @@
 from django.contrib import admin
+from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.urls import reverse
+from django.utils.text import Truncator
 
 from posts.models import Post, Group, Comment, Follow
+from posts.paginators import CachedCountPaginator
+from posts.search import available, matching_ids, terms
+from posts.sharding import unsharded
 
 
-class PostAdmin(admin.ModelAdmin):
+class FastChangeListMixin:
+    """Список без точного COUNT на каждую страницу.
+
+    Число строк берется из кэша, общее число без фильтров не считается.
+    """
+    paginator = CachedCountPaginator
+    show_full_result_count = False
+
+
+class UnshardedMixin:
+    """Списки и формы админки читают только default"""
+
+    def get_queryset(self, request):
+        unsharded('admin')
+        return super().get_queryset(request)
+
+
+class IndexedSearchMixin:
+    """Поиск по тексту через индекс posts.search вместо LIKE"""
+
+    def get_search_results(self, request, queryset, search_term):
+        if not available() or not terms(search_term):
+            return super().get_search_results(
+                request, queryset, search_term
+            )
+        return queryset.filter(
+            pk__in=matching_ids(queryset.model, search_term)
+        ), False
+
+
+class PreloadedRawIdWidget(ForeignKeyRawIdWidget):
+    """Поле id с подписью из заранее загруженных объектов"""
+
+    def __init__(self, rel, admin_site, objects, **kwargs):
+        super().__init__(rel, admin_site, **kwargs)
+        self.objects = objects
+
+    def label_and_url_for_value(self, value):
+        try:
+            obj = self.objects.get(int(value))
+        except (TypeError, ValueError):
+            obj = None
+        if obj is None:
+            return super().label_and_url_for_value(value)
+        return Truncator(obj).words(14), reverse(
+            f'{self.admin_site.name}:posts_group_change', args=(obj.pk,)
+        )
+
+
+class PostAdmin(
+    UnshardedMixin, FastChangeListMixin, IndexedSearchMixin, admin.ModelAdmin
+):
     list_display = (
         'pk',
         'text',
@@ -12,10 +69,21 @@ class PostAdmin(admin.ModelAdmin):
         'group',
     )
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
+    raw_id_fields = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'group':
+            # Групп немного: подписи всех строк списка одним запросом
+            kwargs['widget'] = PreloadedRawIdWidget(
+                db_field.remote_field, self.admin_site,
+                Group.objects.in_bulk(), using=kwargs.get('using')
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = (
@@ -26,25 +94,32 @@ class GroupAdmin(admin.ModelAdmin):
     empty_value_display = '-пусто-'
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(
+    UnshardedMixin, FastChangeListMixin, IndexedSearchMixin,
+    admin.ModelAdmin
+):
     list_display = (
         'text',
         'author',
         'created',
         'post'
     )
+    list_select_related = ('author', 'post')
+    raw_id_fields = ('author', 'post')
     search_fields = ('text',)
     list_filter = ('created',)
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(FastChangeListMixin, admin.ModelAdmin):
     list_display = (
         'user',
         'author'
     )
+    list_select_related = ('user', 'author')
+    raw_id_fields = ('user', 'author')
     search_fields = (
-        'user',
-        'author'
+        '=user__username',
+        '=author__username'
     )
 
 
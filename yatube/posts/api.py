@@ -0,0 +1,423 @@
+"""JSON API сообщений, групп, комментариев и подписок.
+
+Списки листаются курсором CursorPaginator: ответ содержит results и
+готовые ссылки next и previous. ?fields=id,text оставляет в ответе
+только перечисленные поля, и из базы читаются только их столбцы.
+?embed=author,group заменяет имя автора и slug группы объектами,
+которые приходят тем же запросом через select_related. ETag и
+Last-Modified строятся по тем же версиям, что у HTML-страниц, поэтому
+неизменившийся список отдается ответом 304 без запросов к спискам.
+Запись - сессия пользователя и CSRF, как у форм сайта; тело запроса -
+JSON или форма (картинка загружается только формой).
+"""
+import json
+from collections import namedtuple
+from functools import wraps
+
+from django.conf import settings as s
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse, JsonResponse, QueryDict
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.views.decorators.http import condition
+
+from posts.conditional import (
+    conditional_page, group_versions, index_versions, post_versions,
+    profile_versions
+)
+from posts.fragments import get_versions, shared_versions, version_key
+from posts.forms import PostForm, CommentForm
+from posts.models import Post, Group, User, Follow
+from posts.paginators import CursorPaginator
+from posts.sharding import get_or_404, scatter
+
+Field = namedtuple('Field', 'columns get')
+
+
+class ApiError(Exception):
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def split(value):
+    return [item for item in (value or '').split(',') if item]
+
+
+class Resource:
+    """Поля одного типа: имя -> столбцы в базе и значение в ответе.
+
+    embeds - поля-связи, которые по ?embed= отдаются вложенным
+    ресурсом вместо короткого значения.
+    """
+
+    def __init__(self, fields, embeds=None):
+        self.fields = fields
+        self.embeds = embeds or {}
+
+    def columns(self):
+        return [column for field in self.fields.values()
+                for column in field.columns]
+
+    def parse(self, request):
+        """Запрошенные поля и вложения, ApiError для неизвестных"""
+        fields = split(request.GET.get('fields')) or list(self.fields)
+        embeds = set(split(request.GET.get('embed')))
+        unknown = [name for name in fields if name not in self.fields]
+        unknown += [name for name in embeds if name not in self.embeds]
+        if unknown:
+            raise ApiError(400, f'Неизвестные поля: {", ".join(unknown)}')
+        return fields, embeds & set(fields)
+
+    def load(self, queryset, fields, embeds, key=None):
+        """queryset, читающий только столбцы fields, связи - join"""
+        columns = {key} if key else set()
+        for name in fields:
+            if name in embeds:
+                columns.update(
+                    f'{name}__{column}'
+                    for column in self.embeds[name].columns()
+                )
+            else:
+                columns.update(self.fields[name].columns)
+        related = {column.split('__')[0] for column in columns
+                   if '__' in column}
+        return queryset.select_related(*related).only(*columns, *related)
+
+    def dump(self, obj, fields=None, embeds=()):
+        data = {}
+        for name in fields or self.fields:
+            if name in embeds:
+                related = getattr(obj, name)
+                data[name] = None if related is None else (
+                    self.embeds[name].dump(related)
+                )
+            else:
+                data[name] = self.fields[name].get(obj)
+        return data
+
+
+def image_data(post):
+    if not post.image:
+        return None
+    return {
+        'url': post.image.url,
+        'width': post.image_width,
+        'height': post.image_height,
+    }
+
+
+USER = Resource({
+    'username': Field(('username',), lambda user: user.username),
+    'first_name': Field(('first_name',), lambda user: user.first_name),
+    'last_name': Field(('last_name',), lambda user: user.last_name),
+})
+GROUP = Resource({
+    'slug': Field(('slug',), lambda group: group.slug),
+    'title': Field(('title',), lambda group: group.title),
+    'description': Field(
+        ('description',), lambda group: group.description
+    ),
+    'posts_count': Field(
+        ('posts_count',), lambda group: group.posts_count
+    ),
+})
+POST = Resource({
+    'id': Field(('id',), lambda post: post.pk),
+    'text': Field(('text',), lambda post: post.text),
+    'pub_date': Field(('pub_date',), lambda post: post.pub_date),
+    'author': Field(
+        ('author__username',), lambda post: post.author.username
+    ),
+    'group': Field(
+        ('group__slug',), lambda post: post.group and post.group.slug
+    ),
+    'image': Field(('image', 'image_width', 'image_height'), image_data),
+    'comments_count': Field(
+        ('comments_count',), lambda post: post.comments_count
+    ),
+}, embeds={'author': USER, 'group': GROUP})
+COMMENT = Resource({
+    'id': Field(('id',), lambda comment: comment.pk),
+    'post': Field(('post_id',), lambda comment: comment.post_id),
+    'author': Field(
+        ('author__username',), lambda comment: comment.author.username
+    ),
+    'text': Field(('text',), lambda comment: comment.text),
+    'created': Field(('created',), lambda comment: comment.created),
+}, embeds={'author': USER})
+FOLLOW = Resource({
+    'author': Field(
+        ('author__username',), lambda follow: follow.author.username
+    ),
+}, embeds={'author': USER})
+
+
+def respond(data, status=200):
+    return JsonResponse(
+        data, status=status, json_dumps_params={'ensure_ascii': False}
+    )
+
+
+def endpoint(**handlers):
+    """view из обработчиков по методам: get=..., post=...
+
+    Ошибки обработчиков отдаются JSON-ом {"detail": ...} с кодом
+    ответа, а не HTML-страницами сайта.
+    """
+    allowed = ', '.join(sorted(method.upper() for method in handlers))
+
+    def view(request, **kwargs):
+        method = 'get' if request.method == 'HEAD' else request.method
+        handler = handlers.get(method.lower())
+        if handler is None:
+            response = respond({'detail': 'Метод не поддерживается'}, 405)
+            response['Allow'] = allowed
+            return response
+        if method.lower() != 'get' and not request.user.is_authenticated:
+            return respond({'detail': 'Нужна авторизация'}, 401)
+        try:
+            return handler(request, **kwargs)
+        except Http404:
+            return respond({'detail': 'Не найдено'}, 404)
+        except PermissionDenied:
+            return respond({'detail': 'Недостаточно прав'}, 403)
+        except ApiError as error:
+            return respond({'detail': error.detail}, error.status)
+    return view
+
+
+def body(request):
+    """Данные записи: JSON-объект или поля формы.
+
+    Django разбирает форму только в POST, форму в PATCH читаем сами.
+    Файлы (multipart) принимаются только в POST.
+    """
+    if request.content_type != 'application/json':
+        if request.method == 'POST':
+            return request.POST
+        if request.content_type == 'application/x-www-form-urlencoded':
+            return QueryDict(request.body, encoding=request.encoding)
+        raise ApiError(415, 'Ожидается JSON или форма urlencoded')
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError:
+        raise ApiError(400, 'Некорректный JSON')
+    if not isinstance(data, dict):
+        raise ApiError(400, 'Ожидается JSON-объект')
+    return data
+
+
+def invalid(form):
+    return respond({'errors': form.errors.get_json_data()}, 400)
+
+
+def limit(request):
+    try:
+        value = int(request.GET.get('limit', s.NUMBER_MESSAGES))
+    except ValueError:
+        raise ApiError(400, 'limit должен быть числом')
+    return min(max(value, 1), s.API_MAX_LIMIT)
+
+
+def link(request, cursor):
+    if cursor is None:
+        return None
+    query = request.GET.copy()
+    query.pop('page', None)
+    query['cursor'] = cursor
+    return f'{request.path}?{query.urlencode()}'
+
+
+def listing(request, resource, queryset, key=None):
+    """Страница списка: поля по ?fields=, курсор по ?cursor=.
+
+    Сообщения и комментарии читаются со своих шардов через scatter.
+    """
+    fields, embeds = resource.parse(request)
+    page = CursorPaginator(
+        scatter(resource.load(queryset, fields, embeds, key)),
+        limit(request), key=key
+    ).get_page(request.GET.get('page'), request.GET.get('cursor'))
+    return respond({
+        'results': [resource.dump(obj, fields, embeds) for obj in page],
+        'next': link(request, page.next_cursor),
+        'previous': link(request, page.previous_cursor),
+    })
+
+
+def detail(request, resource, queryset, pk=None, **lookup):
+    """Объект по pk с учетом шардов или по другим полям lookup"""
+    fields, embeds = resource.parse(request)
+    queryset = resource.load(queryset, fields, embeds)
+    if pk is not None:
+        obj = get_or_404(queryset, pk)
+    else:
+        obj = get_object_or_404(queryset, **lookup)
+    return respond(resource.dump(obj, fields, embeds))
+
+
+def created(resource, obj, location):
+    response = respond(resource.dump(obj), 201)
+    response['Location'] = location
+    return response
+
+
+@conditional_page(index_versions)
+def post_list(request):
+    return listing(request, POST, Post.objects.all(), key='pub_date')
+
+
+def post_form(*args, **kwargs):
+    """PostForm, в которой группа задается slug, как в ответах"""
+    form = PostForm(*args, **kwargs)
+    form.fields['group'].to_field_name = 'slug'
+    return form
+
+
+def post_create(request):
+    form = post_form(body(request), files=request.FILES or None)
+    if not form.is_valid():
+        return invalid(form)
+    post = form.save(commit=False)
+    post.author = request.user
+    post.save()
+    return created(
+        POST, post, reverse('posts:api_post', args=(post.pk,))
+    )
+
+
+@conditional_page(post_versions)
+def post_get(request, post_id):
+    return detail(request, POST, Post.objects.all(), pk=post_id)
+
+
+def own_post(request, post_id):
+    post = get_or_404(Post.objects.all(), post_id)
+    if post.author_id != request.user.pk:
+        raise PermissionDenied
+    return post
+
+
+def post_update(request, post_id):
+    """Частичное изменение: отсутствующие поля остаются прежними"""
+    post = own_post(request, post_id)
+    data = {'text': post.text, 'group': post.group and post.group.slug}
+    data.update(body(request).items())
+    form = post_form(data, instance=post)
+    if not form.is_valid():
+        return invalid(form)
+    return respond(POST.dump(form.save()))
+
+
+def post_delete(request, post_id):
+    own_post(request, post_id).delete()
+    return HttpResponse(status=204)
+
+
+@conditional_page(post_versions)
+def comment_list(request, post_id):
+    post = get_or_404(Post.objects.only('pk'), post_id)
+    return listing(request, COMMENT, post.comments.all(), key='created')
+
+
+def comment_create(request, post_id):
+    post = get_or_404(Post.objects.only('pk'), post_id)
+    form = CommentForm(body(request))
+    if not form.is_valid():
+        return invalid(form)
+    comment = form.save(commit=False)
+    comment.author = request.user
+    comment.post = post
+    comment.save()
+    return created(
+        COMMENT, comment, reverse('posts:api_comments', args=(post_id,))
+    )
+
+
+@conditional_page(lambda: (('site', 'all'),))
+def group_list(request):
+    return listing(request, GROUP, Group.objects.order_by('pk'))
+
+
+@conditional_page(group_versions)
+def group_get(request, slug):
+    return detail(request, GROUP, Group.objects.all(), slug=slug)
+
+
+@conditional_page(group_versions)
+def group_posts(request, slug):
+    group = get_object_or_404(Group.objects.only('pk'), slug=slug)
+    return listing(
+        request, POST, Post.objects.filter(group=group), key='pub_date'
+    )
+
+
+@conditional_page(profile_versions)
+def user_posts(request, username):
+    author = get_object_or_404(User.objects.only('pk'), username=username)
+    return listing(request, POST, author.posts.all(), key='pub_date')
+
+
+def follows_etag(request):
+    if not request.user.is_authenticated or not shared_versions():
+        return None
+    versions = get_versions([
+        version_key('site', 'all'),
+        version_key('follows', request.user.pk),
+    ])
+    return f'{request.user.pk}-' + '-'.join(
+        str(versions[key]) for key in sorted(versions)
+    )
+
+
+def authenticated(view):
+    @wraps(view)
+    def wrapper(request, **kwargs):
+        if not request.user.is_authenticated:
+            raise ApiError(401, 'Нужна авторизация')
+        return view(request, **kwargs)
+    return wrapper
+
+
+@authenticated
+@condition(etag_func=follows_etag)
+def follow_list(request):
+    return listing(
+        request, FOLLOW,
+        Follow.objects.filter(user=request.user).order_by('pk')
+    )
+
+
+def follow_create(request):
+    username = body(request).get('author')
+    author = get_object_or_404(User, username=username or '')
+    if author == request.user:
+        raise ApiError(400, 'Нельзя подписаться на себя')
+    follow, new = Follow.objects.get_or_create(
+        user=request.user, author=author
+    )
+    response = respond(FOLLOW.dump(follow), 201 if new else 200)
+    response['Location'] = reverse('posts:api_follow', args=(username,))
+    return response
+
+
+def follow_delete(request, username):
+    deleted, _ = Follow.objects.filter(
+        user=request.user, author__username=username
+    ).delete()
+    if not deleted:
+        raise Http404
+    return HttpResponse(status=204)
+
+
+posts_api = endpoint(get=post_list, post=post_create)
+post_api = endpoint(get=post_get, patch=post_update, delete=post_delete)
+comments_api = endpoint(get=comment_list, post=comment_create)
+groups_api = endpoint(get=group_list)
+group_api = endpoint(get=group_get)
+group_posts_api = endpoint(get=group_posts)
+user_posts_api = endpoint(get=user_posts)
+follows_api = endpoint(get=follow_list, post=follow_create)
+follow_api = endpoint(delete=follow_delete)
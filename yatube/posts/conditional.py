@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from posts.fragments import get_versions, shared_versions, version_key
+from posts.models import Post, Group, User
+from posts.sharding import lookup
+
+
+def page_versions(request, keys_func, kwargs):
+    """Версии страницы, считаются один раз на запрос"""
+    if not hasattr(request, '_page_versions'):
+        keys = keys_func(**kwargs) if shared_versions() else None
+        request._page_versions = get_versions(
+            [version_key(kind, pk) for kind, pk in keys]
+        ) if keys else None
+    return request._page_versions
+
+
+def conditional_page(keys_func):
+    """ETag и Last-Modified страницы по версиям из кэша.
+
+    keys_func получает аргументы view и возвращает пары (вид, pk)
+    версий, от которых зависит страница, или None, если проверить
+    страницу нельзя. При совпадении ответ 304 отдается до работы
+    view. Страница зависит и от пользователя, поэтому он входит в
+    ETag, а время его входа - в Last-Modified. С кэшем в памяти
+    процесса (LocMemCache) заголовков нет: см. shared_versions.
+    """
+    def etag(request, **kwargs):
+        versions = page_versions(request, keys_func, kwargs)
+        if versions is None:
+            return None
+        viewer = request.user.pk or 'anon'
+        return f'{viewer}-' + '-'.join(
+            str(versions[key]) for key in sorted(versions)
+        )
+
+    def last_modified(request, **kwargs):
+        versions = page_versions(request, keys_func, kwargs)
+        if versions is None:
+            return None
+        modified = datetime.fromtimestamp(
+            max(versions.values()) / 1e9, tz=timezone.utc
+        )
+        last_login = getattr(request.user, 'last_login', None)
+        if last_login is not None:
+            modified = max(modified, last_login)
+        return modified
+
+    def decorator(view):
+        return cache_control(private=True, no_cache=True)(
+            condition(etag_func=etag, last_modified_func=last_modified)(view)
+        )
+    return decorator
+
+
+def index_versions():
+    return ('site', 'all'), ('feed', 'all')
+
+
+def group_versions(slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True
+    ).first()
+    if group_id is None:
+        return None
+    return ('site', 'all'), ('group_feed', group_id)
+
+
+def profile_versions(username):
+    user_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ).first()
+    if user_id is None:
+        return None
+    return ('site', 'all'), ('user_feed', user_id)
+
+
+def post_versions(post_id):
+    post = lookup(Post.objects.only('author_id'), post_id)
+    if post is None:
+        return None
+    return ('site', 'all'), ('post', post_id), ('user_feed', post.author_id)
@@ -0,0 +1,135 @@
+"""Счетчики сообщений, комментариев и подписок.
+
+Сигналы сдвигают их при записи, rebuild_counters пересчитывает с нуля.
+Сообщения при SHARDS лежат на шардах, а счетчики пользователей, групп
+и файлов - в default: такие числа считаются на каждом шарде,
+складываются и записываются в default.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from posts.models import Post, Group, User, Comment, Follow, UserStats
+from posts.sharding import each, sharded
+
+
+def shift(**deltas):
+    """Выражения UPDATE для атомарного сдвига счетчиков"""
+    return {
+        field: F(field) + delta if delta > 0
+        else Greatest(F(field) + delta, 0)
+        for field, delta in deltas.items()
+    }
+
+
+def bump(queryset, **deltas):
+    return queryset.update(**shift(**deltas))
+
+
+def bump_user(user_id, **deltas):
+    """Сдвигаем счетчики пользователя.
+
+    Отсутствующая строка не создается здесь: пользователь может быть
+    в процессе удаления. Ее пересчитает user_stats при чтении.
+    """
+    bump(UserStats.objects.filter(pk=user_id), **deltas)
+
+
+def user_stats(user):
+    """Счетчики пользователя, создаются пересчетом при отсутствии"""
+    try:
+        return user.stats
+    except UserStats.DoesNotExist:
+        rebuild_user_stats(User.objects.filter(pk=user.pk))
+        return UserStats.objects.get(pk=user.pk)
+
+
+def count_subquery(queryset, field):
+    """Число строк queryset, ссылающихся через field на внешнюю строку"""
+    return Coalesce(
+        Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(
+                field
+            ).annotate(total=Count('pk')).values('total'),
+            output_field=IntegerField()
+        ),
+        0
+    )
+
+
+def shard_counts(queryset, field):
+    """{значение field: число строк queryset}, сложенное по шардам"""
+    totals = Counter()
+    for part in each(queryset.order_by()):
+        totals.update(dict(part.values(field).annotate(
+            total=Count('pk')
+        ).values_list(field, 'total')))
+    totals.pop(None, None)
+    return totals
+
+
+def store_counts(queryset, field, counts):
+    """field строк queryset - из counts по pk, остальным 0"""
+    model = queryset.model
+    with transaction.atomic():
+        rows = queryset.update(**{field: 0})
+        model.objects.bulk_update(
+            [model(pk=pk, **{field: total}) for pk, total in counts.items()],
+            [field], batch_size=500
+        )
+    return rows
+
+
+def rebuild_user_stats(users=None):
+    everyone = users is None
+    if everyone:
+        users = User.objects.all()
+    UserStats.objects.bulk_create(
+        (
+            UserStats(user_id=pk)
+            for pk in users.values_list('pk', flat=True).iterator()
+        ),
+        ignore_conflicts=True
+    )
+    stats = UserStats.objects.filter(user__in=users)
+    if not sharded(Post):
+        return stats.update(
+            posts_count=count_subquery(Post.objects, 'author'),
+            followers_count=count_subquery(Follow.objects, 'author'),
+            following_count=count_subquery(Follow.objects, 'user'),
+        )
+    stats.update(
+        followers_count=count_subquery(Follow.objects, 'author'),
+        following_count=count_subquery(Follow.objects, 'user'),
+    )
+    # Подзапрос к auth_user шард выполнить не может: id списком
+    posts = Post.objects.all() if everyone else Post.objects.filter(
+        author_id__in=list(users.values_list('pk', flat=True))
+    )
+    return store_counts(stats, 'posts_count', shard_counts(posts, 'author'))
+
+
+def rebuild_counters():
+    """Пересчитываем все счетчики, возвращаем число обновленных строк"""
+    if sharded(Post):
+        groups = store_counts(
+            Group.objects.all(), 'posts_count',
+            shard_counts(Post.objects.all(), 'group')
+        )
+    else:
+        groups = Group.objects.update(
+            posts_count=count_subquery(Post.objects, 'group')
+        )
+    return {
+        'users': rebuild_user_stats(),
+        'groups': groups,
+        # Комментарии лежат на шарде своего сообщения
+        'posts': sum(
+            posts.update(
+                comments_count=count_subquery(Comment.objects, 'post')
+            )
+            for posts in each(Post.objects.all())
+        ),
+    }
@@ -0,0 +1,260 @@
+"""Синтетические данные для нагрузочных проверок.
+
+Объекты создаются через bulk_create пачками, проверка внешних ключей
+отключается на время загрузки и выполняется один раз в конце.
+Популярность авторов, групп и сообщений распределена по степенному
+закону: немногие авторы собирают большую часть подписчиков, новые
+сообщения получают больше комментариев. Вставка идет в default, при
+SHARDS генератор не запускается.
+"""
+import io
+import math
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import islice
+
+from django.conf import settings as s
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+
+from posts.counters import rebuild_counters
+from posts.fragments import bump_version
+from posts.media import rebuild_refs
+from posts.models import Post, Group, User, Comment, Follow, Timeline
+from posts.search import rebuild_index
+from posts.sharding import unsharded
+
+WORDS = (
+    'город', 'утро', 'кофе', 'дорога', 'книга', 'море', 'осень', 'кот',
+    'работа', 'друг', 'вечер', 'поезд', 'дождь', 'музыка', 'лес', 'снег',
+    'проект', 'код', 'статья', 'фото', 'сад', 'река', 'гора', 'ветер',
+    'новый', 'старый', 'долгий', 'тихий', 'яркий', 'первый', 'последний',
+)
+
+
+def power_law(rng, n, exponent=1.0):
+    """Номер от 0 до n - 1, малые номера выпадают чаще (закон Ципфа)"""
+    u = rng.random()
+    if exponent == 1.0:
+        rank = math.exp(u * math.log(n + 1))
+    else:
+        power = 1 - exponent
+        rank = ((math.pow(n + 1, power) - 1) * u + 1) ** (1 / power)
+    return min(int(rank) - 1, n - 1)
+
+
+def sentence(rng, low, high):
+    words = rng.choices(WORDS, k=rng.randint(low, high))
+    return ' '.join(words).capitalize() + '.'
+
+
+def insert(model, objects, batch):
+    """bulk_create пачками по batch объектов, возвращает их число"""
+    objects = iter(objects)
+    total = 0
+    while True:
+        chunk = list(islice(objects, batch))
+        if not chunk:
+            return total
+        model.objects.bulk_create(chunk)
+        total += len(chunk)
+
+
+@contextmanager
+def manual_dates(*fields):
+    """Даты auto_now_add берутся из объектов, а не из текущего времени"""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def make_images(count):
+    """Несколько картинок в хранилище, сообщения ссылаются на них"""
+    from PIL import Image
+
+    names = []
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.new('RGB', (640, 480), (i * 37 % 256, 90, 160)).save(
+            buffer, 'PNG'
+        )
+        names.append(default_storage.save(
+            f'posts/dataset_{i}.png', ContentFile(buffer.getvalue())
+        ))
+    return names
+
+
+def last_pk(model):
+    return model.objects.order_by('-pk').values_list(
+        'pk', flat=True
+    ).first() or 0
+
+
+def rebuild_timelines():
+    """Заполняем ленты подписчиков последними TIMELINE_LENGTH записями.
+
+    У каждого автора сначала отбираются его TIMELINE_LENGTH последних
+    сообщений: в ленту не попадет ничего старше, а соединение с
+    подписками не растет вместе с числом сообщений популярных авторов.
+    """
+    Timeline.objects.all().delete()
+    post, follow = Post._meta.db_table, Follow._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {Timeline._meta.db_table} '
+            f'(user_id, post_id, pub_date) '
+            f'SELECT user_id, id, pub_date FROM ('
+            f'SELECT f.user_id, p.id, p.pub_date, ROW_NUMBER() OVER ('
+            f'PARTITION BY f.user_id ORDER BY p.pub_date DESC, p.id DESC'
+            f') AS position FROM {follow} f '
+            f'JOIN ('
+            f'SELECT id, author_id, pub_date FROM ('
+            f'SELECT id, author_id, pub_date, ROW_NUMBER() OVER ('
+            f'PARTITION BY author_id ORDER BY pub_date DESC, id DESC'
+            f') AS latest FROM {post}'
+            f') AS authored WHERE latest <= %s'
+            f') p ON p.author_id = f.author_id'
+            f') AS ranked WHERE position <= %s',
+            [s.TIMELINE_LENGTH, s.TIMELINE_LENGTH]
+        )
+        return cursor.rowcount
+
+
+def rebuild_derived(timelines=True, log=None):
+    """Пересчитываем то, что при обычной записи ведут сигналы"""
+    log = log or (lambda message: None)
+    result = {}
+    if timelines:
+        result['timelines'] = rebuild_timelines()
+        log(f'timelines: {result["timelines"]}')
+    rebuild_counters()
+    rebuild_refs()
+    result['search'] = rebuild_index()
+    log(f'search: {result["search"]}')
+    return result
+
+
+def generate(users=1000, groups=20, posts=100000, comments=200000,
+             follows=20, images=10, image_share=0.2, grouped_share=0.7,
+             batch=5000, timelines=True, seed=None, log=None):
+    """Создаем набор данных заданного размера, возвращаем число строк.
+
+    Каждый пользователь подписывается в среднем на follows авторов.
+    Даты сообщений идут подряд и заканчиваются текущим моментом,
+    комментарии появляются после своего сообщения. Номера новых
+    сообщений считаются идущими подряд, поэтому генератор не
+    запускают параллельно с другими записями в базу. Ленты
+    подписок пересобираются целиком, timelines=False пропускает
+    этот самый долгий шаг.
+    """
+    unsharded('generate')
+    rng = random.Random(seed)
+    log = log or (lambda message: None)
+    result = {}
+    offset = last_pk(User)
+    with connection.constraint_checks_disabled():
+        with transaction.atomic():
+            password = make_password(None)
+            result['users'] = insert(User, (
+                User(
+                    username=f'dataset_{offset + i}',
+                    first_name=rng.choice(WORDS).capitalize(),
+                    password=password,
+                )
+                for i in range(users)
+            ), batch)
+            user_ids = list(User.objects.filter(
+                pk__gt=offset
+            ).values_list('pk', flat=True))
+            rng.shuffle(user_ids)
+            log(f'users: {result["users"]}')
+
+            offset = last_pk(Group)
+            result['groups'] = insert(Group, (
+                Group(
+                    title=sentence(rng, 1, 3)[:200],
+                    slug=f'dataset-{offset + i}',
+                    description=sentence(rng, 5, 20),
+                )
+                for i in range(groups)
+            ), batch)
+            group_ids = list(Group.objects.filter(
+                pk__gt=offset
+            ).values_list('pk', flat=True))
+            log(f'groups: {result["groups"]}')
+
+            follow_pairs = set()
+            for user_id in user_ids:
+                for _ in range(rng.randint(0, 2 * follows)):
+                    author_id = user_ids[power_law(rng, len(user_ids))]
+                    if author_id != user_id:
+                        follow_pairs.add((user_id, author_id))
+            result['follows'] = insert(Follow, (
+                Follow(user_id=user_id, author_id=author_id)
+                for user_id, author_id in follow_pairs
+            ), batch)
+            del follow_pairs
+            log(f'follows: {result["follows"]}')
+
+            pictures = make_images(images) if posts else []
+            step = timedelta(minutes=1)
+            start = timezone.now() - step * posts
+            offset = last_pk(Post)
+            with manual_dates(
+                Post._meta.get_field('pub_date'),
+                Comment._meta.get_field('created')
+            ):
+                result['posts'] = insert(Post, (
+                    Post(
+                        text=sentence(rng, 3, 60),
+                        pub_date=start + step * i,
+                        author_id=user_ids[power_law(rng, len(user_ids))],
+                        group_id=(
+                            group_ids[power_law(rng, len(group_ids))]
+                            if group_ids and rng.random() < grouped_share
+                            else None
+                        ),
+                        image=(
+                            rng.choice(pictures)
+                            if pictures and rng.random() < image_share
+                            else ''
+                        ),
+                    )
+                    for i in range(posts)
+                ), batch)
+                log(f'posts: {result["posts"]}')
+
+                def commented():
+                    for _ in range(comments):
+                        i = posts - 1 - power_law(rng, posts)
+                        yield i, start + step * i + timedelta(
+                            seconds=rng.randint(1, 59)
+                        )
+
+                result['comments'] = insert(Comment, (
+                    Comment(
+                        post_id=offset + 1 + i,
+                        author_id=rng.choice(user_ids),
+                        text=sentence(rng, 1, 15),
+                        created=created,
+                    )
+                    for i, created in (commented() if posts else ())
+                ), batch)
+                log(f'comments: {result["comments"]}')
+
+            result.update(rebuild_derived(timelines, log))
+            connection.check_constraints(table_names=[
+                model._meta.db_table
+                for model in (Post, Comment, Follow, Timeline)
+            ])
+    bump_version('feed', 'all')
+    bump_version('site', 'all')
+    return result
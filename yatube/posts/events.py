@@ -0,0 +1,294 @@
+"""События о новых сообщениях и комментариях для живой ленты.
+
+Сигналы после фиксации транзакции публикуют короткое событие в
+брокер, брокер раздает его очередям подключенных потоков SSE. Каждая
+очередь ограничена: медленный клиент теряет поток и переподключается
+с Last-Event-ID, недостающие события берутся из буфера брокера.
+Номер события в потоке начинается с эпохи брокера: после перезапуска
+номера идут заново, и клиент с номером прошлой эпохи получает reset
+вместо чужих событий.
+
+LocalBroker живет в памяти процесса и годится для одного процесса.
+CacheBroker дополнительно пишет события в кэш, и фоновый поток
+каждого процесса забирает чужие события оттуда - это замена
+настоящему брокеру для нескольких процессов с общим кэшем.
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from itertools import count
+
+from django.conf import settings as s
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+
+def new_epoch():
+    return str(time.time_ns())
+
+
+def parse_id(value):
+    """(эпоха, номер) из Last-Event-ID, None без номера"""
+    epoch, _, number = value.rpartition('-')
+    return (epoch, int(number)) if number.isdigit() else None
+
+
+class LocalBroker:
+    """Публикация и подписка внутри одного процесса"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.buffer = deque(maxlen=s.EVENTS_BUFFER)
+        self.ids = count(1)
+        self.epoch = new_epoch()
+
+    def next_id(self):
+        return next(self.ids)
+
+    def publish(self, kind, data):
+        event = (self.next_id(), kind, data)
+        self.deliver(event)
+        return event
+
+    def deliver(self, event):
+        with self.lock:
+            self.buffer.append(event)
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Поток закроется и продолжит с Last-Event-ID
+                self.unsubscribe(subscriber)
+                subscriber.overflow = True
+
+    def subscribe(self, subscriber=None):
+        """Новая очередь подписчика или готовая с put_nowait"""
+        if subscriber is None:
+            subscriber = queue.Queue(maxsize=s.EVENTS_QUEUE_SIZE)
+        subscriber.overflow = False
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def since(self, last_id):
+        """События после last_id из буфера, None - буфер их не хранит"""
+        with self.lock:
+            events = list(self.buffer)
+        if events and min(event[0] for event in events) > last_id + 1:
+            return None
+        return sorted(event for event in events if event[0] > last_id)
+
+
+class CacheBroker(LocalBroker):
+    """LocalBroker, который делится событиями через общий кэш"""
+
+    def __init__(self):
+        super().__init__()
+        self.origin = f'{os.getpid()}:{id(self)}'
+        self.last = self.current()
+        self.seen = self.epoch
+        threading.Thread(target=self.pump, daemon=True).start()
+
+    @staticmethod
+    def key(event_id):
+        return f'events:{event_id}'
+
+    def current(self):
+        if cache.add('events:last', 0, None):
+            # Счетчик начат заново, прежние номера из другой эпохи
+            cache.set('events:epoch', new_epoch(), None)
+        self.epoch = cache.get_or_set('events:epoch', new_epoch, None)
+        return cache.get('events:last', 0)
+
+    def next_id(self):
+        self.current()
+        return cache.incr('events:last')
+
+    def publish(self, kind, data):
+        event = (self.next_id(), kind, data)
+        cache.set(
+            self.key(event[0]), (self.origin, event), s.EVENTS_CACHE_TIMEOUT
+        )
+        self.deliver(event)
+        return event
+
+    def pump(self):
+        """Забираем из кэша события других процессов"""
+        while True:
+            time.sleep(s.EVENTS_POLL_INTERVAL)
+            last = self.current()
+            if self.epoch != self.seen:
+                # Счетчик начат заново: читаем новую эпоху с начала
+                self.seen, self.last = self.epoch, 0
+            if last <= self.last:
+                continue
+            found = cache.get_many(
+                [self.key(event_id) for event_id in range(
+                    max(self.last + 1, last - s.EVENTS_BUFFER + 1), last + 1
+                )]
+            )
+            self.last = last
+            for key in sorted(found, key=lambda key: found[key][1][0]):
+                origin, event = found[key]
+                if origin != self.origin:
+                    self.deliver(event)
+
+
+class AsyncSubscriber:
+    """Очередь asyncio, которую брокер наполняет из любого потока"""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=s.EVENTS_QUEUE_SIZE)
+
+    def put_nowait(self, event):
+        if self.queue.full():
+            raise queue.Full
+        self.loop.call_soon_threadsafe(self.add, event)
+
+    def add(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflow = True
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            raise queue.Empty
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(s.EVENTS_BROKER)()
+        return _broker
+
+
+def post_event(post):
+    return {
+        'id': post.pk,
+        'author': post.author_id,
+        'group': post.group_id,
+    }
+
+
+def comment_event(comment):
+    return {
+        'id': comment.pk,
+        'post': comment.post_id,
+        'author': comment.author_id,
+    }
+
+
+def publish(kind, data):
+    return broker().publish(kind, data)
+
+
+def encode(event, epoch):
+    event_id, kind, data = event
+    return (
+        f'id: {epoch}-{event_id}\nevent: {kind}\n'
+        f'data: {json.dumps(data, separators=(",", ":"))}\n\n'
+    )
+
+
+def stream(accept, last_id=None, max_age=None, heartbeat=None):
+    """Строки SSE: пропущенные после last_id события, затем новые.
+
+    last_id - пара из parse_id, при другой эпохе клиент получает
+    reset. accept(kind, data) отбирает события для этого клиента. Поток
+    заканчивается через max_age секунд или при переполнении очереди,
+    браузер переподключается сам и присылает Last-Event-ID.
+    """
+    hub = broker()
+    subscriber = hub.subscribe()
+    feed = Feed(accept, last_id, max_age, heartbeat)
+    try:
+        yield from feed.start(hub)
+        while feed.left() and not subscriber.overflow:
+            try:
+                chunk = feed.encode(subscriber.get(timeout=feed.timeout()))
+            except queue.Empty:
+                chunk = feed.encode(None)
+            if chunk:
+                yield chunk
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+async def astream(accept, last_id=None, max_age=None, heartbeat=None):
+    """stream для цикла событий: ожидание не занимает поток"""
+    hub = broker()
+    subscriber = hub.subscribe(AsyncSubscriber())
+    feed = Feed(accept, last_id, max_age, heartbeat)
+    try:
+        for chunk in feed.start(hub):
+            yield chunk
+        while feed.left() and not subscriber.overflow:
+            try:
+                chunk = feed.encode(await subscriber.get(feed.timeout()))
+            except queue.Empty:
+                chunk = feed.encode(None)
+            if chunk:
+                yield chunk
+    finally:
+        hub.unsubscribe(subscriber)
+
+
+class Feed:
+    """Состояние одного потока: срок, фильтр и уже отданные события"""
+
+    def __init__(self, accept, last_id, max_age, heartbeat):
+        self.accept = accept
+        self.last_id = last_id
+        self.heartbeat = heartbeat or s.EVENTS_HEARTBEAT
+        self.deadline = time.monotonic() + (
+            s.EVENTS_MAX_AGE if max_age is None else max_age
+        )
+        self.replayed = set()
+
+    def left(self):
+        return self.deadline > time.monotonic()
+
+    def timeout(self):
+        return min(self.heartbeat, self.deadline - time.monotonic())
+
+    def start(self, hub):
+        """retry и пропущенные после last_id события"""
+        yield f'retry: {s.EVENTS_RETRY}\n\n'
+        self.epoch = hub.epoch
+        if self.last_id is None:
+            return
+        epoch, last_id = self.last_id
+        missed = hub.since(last_id) if epoch == self.epoch else None
+        if missed is None:
+            yield 'event: reset\ndata: {}\n\n'
+        for event in missed or ():
+            self.replayed.add(event[0])
+            if self.accept(*event[1:]):
+                yield encode(event, self.epoch)
+
+    def encode(self, event):
+        """Строка события, пустая для чужого, ping без события"""
+        if event is None:
+            return ': ping\n\n'
+        if event[0] in self.replayed or not self.accept(*event[1:]):
+            return ''
+        return encode(event, self.epoch)
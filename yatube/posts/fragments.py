@@ -0,0 +1,85 @@
+"""Кэш карточек сообщений.
+
+Карточка не зависит от пользователя и хранится под ключом из версий
+сообщения, его группы и автора. Сигналы меняют версию при записи,
+поэтому карточки живут POST_CARD_TIMEOUT и не устаревают. Версии
+лежат в том же кэше: при нескольких процессах он должен быть общим.
+"""
+import time
+
+from django.conf import settings as s
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.template.loader import render_to_string
+
+from posts.kvstore import prefetch_thumbnails
+
+
+def version_key(kind, pk):
+    return f'version:{kind}:{pk}'
+
+
+def bump_version(kind, pk):
+    cache.set(version_key(kind, pk), time.time_ns(), None)
+
+
+def shared_versions():
+    """Версии одни для всех процессов: кэш не в памяти процесса.
+
+    Карточкам это не важно, а ETag, выданный одним процессом, другой
+    сверил бы со своими устаревшими версиями и ответил 304.
+    """
+    return not isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache)
+
+
+def get_versions(keys):
+    """Версии по ключам; пропавшие из кэша получают новую версию"""
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return versions
+
+
+def card_key(post, variant, versions):
+    parts = (
+        versions[version_key('post', post.pk)],
+        versions[version_key('group', post.group_id)],
+        versions[version_key('user', post.author_id)],
+    )
+    return f'post_card:{variant}:{post.pk}:' + ':'.join(map(str, parts))
+
+
+def render_cards(posts, variant):
+    """HTML карточек posts: два обращения к кэшу на всю страницу.
+
+    Записи о миниатюрах для отрисовываемых карточек загружаются
+    заранее одним обращением.
+    """
+    posts = list(posts)
+    versions = get_versions({
+        version_key(kind, pk)
+        for post in posts
+        for kind, pk in (
+            ('post', post.pk),
+            ('group', post.group_id),
+            ('user', post.author_id),
+        )
+    })
+    keys = [card_key(post, variant, versions) for post in posts]
+    cards = cache.get_many(keys)
+    prefetch_thumbnails(
+        post.image.name
+        for post, key in zip(posts, keys)
+        if key not in cards
+    )
+    rendered = {}
+    for post, key in zip(posts, keys):
+        if key not in cards:
+            rendered[key] = cards[key] = render_to_string(
+                f'includes/cards/{variant}.html', {'post': post}
+            )
+    if rendered:
+        cache.set_many(rendered, s.POST_CARD_TIMEOUT)
+    return [cards[key] for key in keys]
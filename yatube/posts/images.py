@@ -0,0 +1,34 @@
+"""Лесенка размеров картинки сообщения.
+
+Картинка нарезается в пропорциях карточки POST_IMAGE_CROP на ширины
+POST_IMAGE_WIDTHS, а если Pillow умеет WebP - еще и в этом формате.
+Браузер выбирает подходящий вариант по srcset и sizes.
+"""
+from functools import lru_cache
+
+from django.conf import settings as s
+
+
+@lru_cache(maxsize=None)
+def webp_supported():
+    from PIL import features
+
+    return bool(features.check('webp'))
+
+
+def formats():
+    return ('JPEG', 'WEBP') if webp_supported() else ('JPEG',)
+
+
+def geometry(width):
+    crop_width, crop_height = s.POST_IMAGE_CROP
+    return f'{width}x{round(width * crop_height / crop_width)}'
+
+
+def variants():
+    """Пары (геометрия, параметры sorl) всех вариантов картинки"""
+    return [
+        (geometry(width), {'crop': 'center', 'upscale': True, 'format': fmt})
+        for fmt in formats()
+        for width in s.POST_IMAGE_WIDTHS
+    ]
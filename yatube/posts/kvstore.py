@@ -0,0 +1,130 @@
+"""Хранилище ключей sorl-thumbnail с LRU в памяти процесса.
+
+Записи о готовых миниатюрах почти не меняются, поэтому процесс
+держит последние THUMBNAIL_LRU_SIZE из них у себя и не ходит за
+ними ни в кэш, ни в базу. prefetch_thumbnails загружает записи
+для всей страницы карточек одним обращением к кэшу и одним к базе.
+Отсутствие записи помнится THUMBNAIL_MISS_TIMEOUT секунд и в LRU, и
+в кэше: миниатюру вот-вот создаст фоновый поток, возможно, в другом
+процессе.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings as s
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import EMPTY_VALUE
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from posts.images import variants
+
+
+class LRUKVStore(KVStore):
+    """cached_db хранилище sorl с ограниченным LRU перед ним"""
+
+    def __init__(self):
+        super().__init__()
+        self.size = s.THUMBNAIL_LRU_SIZE
+        self.local = OrderedDict()
+        self.lock = threading.Lock()
+
+    def remember(self, key, value):
+        """value=None - записи нет до истечения THUMBNAIL_MISS_TIMEOUT"""
+        if value is None:
+            value = (EMPTY_VALUE, time.monotonic() + s.THUMBNAIL_MISS_TIMEOUT)
+        with self.lock:
+            self.local[key] = value
+            self.local.move_to_end(key)
+            while len(self.local) > self.size:
+                self.local.popitem(last=False)
+
+    def recall(self, key):
+        """Значение, None для промаха или KeyError - нужно загрузить"""
+        with self.lock:
+            value = self.local[key]
+            if isinstance(value, tuple):
+                if value[1] < time.monotonic():
+                    del self.local[key]
+                    raise KeyError(key)
+                return None
+            self.local.move_to_end(key)
+            return value
+
+    def known(self, key):
+        try:
+            self.recall(key)
+        except KeyError:
+            return False
+        return True
+
+    def forget(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.local.pop(key, None)
+
+    def forget_all(self):
+        with self.lock:
+            self.local.clear()
+
+    def prefetch(self, keys):
+        """Загружаем значения keys: один get_many и один запрос к базе.
+
+        Возвращает загруженные значения, None - записи нет.
+        """
+        keys = [key for key in keys if not self.known(key)]
+        if not keys:
+            return {}
+        values = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in values]
+        if missing:
+            stored = dict(KVStoreModel.objects.filter(
+                key__in=missing
+            ).values_list('key', 'value'))
+            self.cache.set_many(stored, sorl_settings.THUMBNAIL_CACHE_TIMEOUT)
+            self.cache.set_many(
+                {key: EMPTY_VALUE for key in missing if key not in stored},
+                s.THUMBNAIL_MISS_TIMEOUT
+            )
+            values.update(stored)
+        loaded = {}
+        for key in keys:
+            value = values.get(key, EMPTY_VALUE)
+            loaded[key] = None if value == EMPTY_VALUE else value
+            self.remember(key, loaded[key])
+        return loaded
+
+    def clear(self, delete_thumbnails=False):
+        super().clear(delete_thumbnails)
+        self.forget_all()
+
+    def _get_raw(self, key):
+        try:
+            return self.recall(key)
+        except KeyError:
+            return self.prefetch([key]).get(key)
+
+    def _set_raw(self, key, value):
+        super()._set_raw(key, value)
+        self.remember(key, value)
+
+    def _delete_raw(self, *keys):
+        super()._delete_raw(*keys)
+        self.forget(*keys)
+
+
+def prefetch_thumbnails(names):
+    """Готовим записи о вариантах картинок names"""
+    names = [name for name in names if name]
+    prefetch = getattr(default.kvstore, 'prefetch', None)
+    thumbnail_file = getattr(default.backend, 'thumbnail_file', None)
+    if not names or prefetch is None or thumbnail_file is None:
+        return
+    prefetch([
+        add_prefix(thumbnail_file(name, geometry, options).key)
+        for name in set(names)
+        for geometry, options in variants()
+    ])
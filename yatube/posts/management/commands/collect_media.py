@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from posts.media import collect_garbage, rebuild_refs
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает ссылки на картинки и удаляет файлы без ссылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=60,
+            help='Не удалять неизвестные файлы моложе стольких минут'
+        )
+
+    def handle(self, *args, **options):
+        blobs = rebuild_refs()
+        removed = collect_garbage(
+            Post._meta.get_field('image').upload_to,
+            timedelta(minutes=options['grace'])
+        )
+        self.stdout.write(f'blobs: {blobs}, removed: {removed}')
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.transfer import MODELS, open_text, write_csv, write_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Выгружает группы, сообщения, комментарии и подписки'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='Файл .jsonl (.jsonl.gz, - для stdout) или каталог для CSV'
+        )
+        parser.add_argument(
+            '--format', choices=('jsonl', 'csv'), default='jsonl'
+        )
+        parser.add_argument(
+            '--models', nargs='+', choices=MODELS, default=MODELS
+        )
+        parser.add_argument('--chunk', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        models = [name for name in MODELS if name in options['models']]
+        if options['format'] == 'csv':
+            counts = write_csv(options['path'], models, options['chunk'])
+        else:
+            with open_text(options['path'], 'w') as file:
+                counts = write_jsonl(file, models, options['chunk'])
+        elapsed = time.monotonic() - start
+        rows = sum(counts.values())
+        # stdout может быть занят самой выгрузкой
+        self.stderr.write(
+            f'{counts}: {rows / max(elapsed, 1e-9):.0f} rows/s, '
+            f'{elapsed:.1f}s'
+        )
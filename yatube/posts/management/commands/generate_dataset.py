@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.dataset import generate
+
+
+class Command(BaseCommand):
+    help = 'Создает синтетический набор данных для нагрузочных проверок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=100000)
+        parser.add_argument('--comments', type=int, default=200000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Среднее число подписок пользователя'
+        )
+        parser.add_argument(
+            '--images', type=int, default=10,
+            help='Число разных картинок у сообщений'
+        )
+        parser.add_argument('--image-share', type=float, default=0.2)
+        parser.add_argument('--batch', type=int, default=5000)
+        parser.add_argument(
+            '--no-timelines', action='store_false', dest='timelines',
+            help='Не пересобирать ленты подписок'
+        )
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        generate(
+            users=options['users'],
+            groups=options['groups'],
+            posts=options['posts'],
+            comments=options['comments'],
+            follows=options['follows'],
+            images=options['images'],
+            image_share=options['image_share'],
+            batch=options['batch'],
+            timelines=options['timelines'],
+            seed=options['seed'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(f'done in {time.monotonic() - start:.1f}s')
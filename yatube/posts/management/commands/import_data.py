@@ -0,0 +1,41 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts.transfer import load, open_text, read_csv, read_jsonl
+
+
+class Command(BaseCommand):
+    help = 'Загружает выгрузку export_data из JSON Lines или CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help='Файл .jsonl (.jsonl.gz, - для stdin) или каталог с CSV'
+        )
+        parser.add_argument('--batch', type=int, default=5000)
+        parser.add_argument(
+            '--no-timelines', action='store_false', dest='timelines',
+            help='Не пересобирать ленты подписок'
+        )
+
+    def handle(self, *args, **options):
+        start = time.monotonic()
+        path = options['path']
+        load_options = {
+            'batch': options['batch'],
+            'timelines': options['timelines'],
+            'log': self.stdout.write,
+        }
+        if os.path.isdir(path):
+            result = load(read_csv(path), **load_options)
+        else:
+            with open_text(path, 'r') as file:
+                result = load(read_jsonl(file), **load_options)
+        elapsed = time.monotonic() - start
+        rows = sum(result['read'].values())
+        self.stdout.write(
+            f'read {rows} in {elapsed:.1f}s, '
+            f'{rows / max(elapsed, 1e-9):.0f} rows/s'
+        )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from posts.sharding import each
+from posts.thumbnails import generate
+
+
+class Command(BaseCommand):
+    help = 'Создает недостающие варианты картинок сообщений'
+
+    def handle(self, *args, **options):
+        names = set()
+        for posts in each(Post.objects.exclude(image='').order_by()):
+            names.update(posts.values_list('image', flat=True).distinct())
+        for name in sorted(names):
+            generate(name)
+        self.stdout.write(f'images: {len(names)}')
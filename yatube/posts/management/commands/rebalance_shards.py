@@ -0,0 +1,71 @@
+import time
+
+from django.conf import settings as s
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from posts.models import Post, User
+from posts.sharding import loads, move_author, plan, shard_for
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит авторов между шардами SHARDS: выравнивает число '
+        'сообщений, переносит одного автора или забирает сообщения '
+        'из default'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--author', help='Имя автора для переноса')
+        parser.add_argument('--to', help='Шард для --author')
+        parser.add_argument(
+            '--from-default', action='store_true',
+            help='Разложить по шардам сообщения, лежащие в default'
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.1,
+            help='Допустимая разница шардов в долях от среднего'
+        )
+        parser.add_argument('--batch', type=int, default=500)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать переносы'
+        )
+
+    def handle(self, *args, **options):
+        if not s.SHARDS:
+            raise CommandError('SHARDS пуст')
+        start = time.monotonic()
+        moves = self.moves(options)
+        posts = 0
+        for author_id, source, target in moves:
+            self.stdout.write(f'{author_id}: {source} -> {target}')
+            if not options['dry_run']:
+                posts += move_author(
+                    author_id, source, target, options['batch']
+                )
+        self.stdout.write(
+            f'authors: {len(moves)}, posts: {posts}, '
+            f'{time.monotonic() - start:.1f}s'
+        )
+
+    def moves(self, options):
+        if options['from_default']:
+            authors = Post.objects.using(DEFAULT_DB_ALIAS).order_by(
+                'author_id'
+            ).values_list('author_id', flat=True).distinct()
+            return [
+                (author_id, DEFAULT_DB_ALIAS, shard_for(author_id))
+                for author_id in authors
+            ]
+        if options['author']:
+            if options['to'] not in s.SHARDS:
+                raise CommandError(f'--to должен быть одним из {s.SHARDS}')
+            author = User.objects.filter(username=options['author']).first()
+            if author is None:
+                raise CommandError(f'Нет автора {options["author"]}')
+            source = shard_for(author.pk)
+            if source == options['to']:
+                return []
+            return [(author.pk, source, options['to'])]
+        return plan(loads(), options['tolerance'])
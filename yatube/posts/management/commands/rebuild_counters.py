@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики сообщений, комментариев и подписок'
+
+    def handle(self, *args, **options):
+        for name, rows in rebuild_counters().items():
+            self.stdout.write(f'{name}: {rows}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from posts.search import available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Заново строит поисковый индекс сообщений и комментариев'
+
+    def handle(self, *args, **options):
+        if not available():
+            self.stdout.write('search index is not available')
+            return
+        self.stdout.write(f'rows: {rebuild_index()}')
@@ -0,0 +1,45 @@
+import sqlite3
+import time
+
+from django.conf import settings as s
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в реплики DATABASE_REPLICAS - '
+        'замена репликации для локального запуска'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--every', type=float, default=0,
+            help='Повторять каждые столько секунд'
+        )
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != 'sqlite':
+            raise CommandError('Копирование файлов - только для SQLite')
+        if not s.DATABASE_REPLICAS:
+            raise CommandError('DATABASE_REPLICAS пуст')
+        while True:
+            self.sync(primary)
+            if not options['every']:
+                return
+            time.sleep(options['every'])
+
+    def sync(self, primary):
+        primary.ensure_connection()
+        for alias in s.DATABASE_REPLICAS:
+            start = time.monotonic()
+            # backup копирует согласованный снимок, даже во время записи
+            replica = sqlite3.connect(connections[alias].settings_dict['NAME'])
+            try:
+                primary.connection.backup(replica)
+            finally:
+                replica.close()
+            self.stdout.write(
+                f'{alias}: {time.monotonic() - start:.2f}s'
+            )
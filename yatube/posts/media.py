@@ -0,0 +1,99 @@
+"""Учет ссылок на файлы картинок.
+
+Хранилище core.storage кладет одинаковые загрузки в один файл,
+поэтому удалить картинку вместе с сообщением нельзя: на нее могут
+ссылаться другие. Blob хранит число сообщений с файлом, сигналы
+сдвигают его при сохранении и удалении сообщений. Файл без ссылок
+удаляется вместе с миниатюрами после фиксации транзакции. При SHARDS
+ссылки считаются по сообщениям всех шардов.
+"""
+import logging
+import os
+from datetime import timedelta
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from sorl.thumbnail import delete
+
+from posts.counters import bump, count_subquery, shard_counts, store_counts
+from posts.models import Blob, Post
+from posts.sharding import sharded
+
+logger = logging.getLogger(__name__)
+
+
+def acquire(name):
+    if not name:
+        return
+    Blob.objects.get_or_create(name=name)
+    bump(Blob.objects.filter(name=name), refs=1)
+
+
+def release(name):
+    if not name:
+        return
+    bump(Blob.objects.filter(name=name), refs=-1)
+    transaction.on_commit(lambda: collect(name))
+
+
+def collect(name):
+    """Удаляем файл и его миниатюры, если ссылок на него не осталось"""
+    deleted, _ = Blob.objects.filter(name=name, refs=0).delete()
+    if deleted:
+        try:
+            delete(name)
+        except SuspiciousFileOperation:
+            logger.warning('file %s is outside of media storage', name)
+    return bool(deleted)
+
+
+def rebuild_refs():
+    """Пересчитываем ссылки по сообщениям, возвращаем число файлов"""
+    if sharded(Post):
+        refs = shard_counts(Post.objects.exclude(image=''), 'image')
+        Blob.objects.bulk_create(
+            (Blob(name=name) for name in refs), ignore_conflicts=True
+        )
+        return store_counts(Blob.objects.all(), 'refs', refs)
+    Blob.objects.bulk_create(
+        (
+            Blob(name=name)
+            for name in Post.objects.exclude(image='').order_by().values_list(
+                'image', flat=True
+            ).distinct().iterator()
+        ),
+        ignore_conflicts=True
+    )
+    return Blob.objects.update(refs=count_subquery(Post.objects, 'image'))
+
+
+def stored_names(directory):
+    """Имена всех файлов в папке хранилища, с вложенными"""
+    directories, files = default_storage.listdir(directory)
+    for file in files:
+        yield os.path.join(directory, file).replace('\\', '/')
+    for nested in directories:
+        yield from stored_names(os.path.join(directory, nested))
+
+
+def collect_garbage(directory, grace=timedelta(hours=1)):
+    """Удаляем файлы без ссылок: учтенные и неизвестные в directory.
+
+    Неизвестные файлы моложе grace не трогаем: это могут быть
+    загрузки, чьи сообщения еще не сохранены.
+    """
+    names = list(Blob.objects.filter(refs=0).values_list('name', flat=True))
+    removed = sum(collect(name) for name in names)
+    if default_storage.exists(directory):
+        known = set(Blob.objects.values_list('name', flat=True))
+        cutoff = timezone.now() - grace
+        for name in stored_names(directory):
+            if (
+                name not in known
+                and default_storage.get_modified_time(name) < cutoff
+            ):
+                delete(name)
+                removed += 1
+    return removed
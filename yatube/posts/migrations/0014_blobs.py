@@ -0,0 +1,37 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:06
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_blobs(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Blob = apps.get_model('posts', 'Blob')
+    Blob.objects.bulk_create(
+        Blob(name=name, refs=refs)
+        for name, refs in Post.objects.exclude(image='').order_by().values(
+            'image'
+        ).annotate(refs=Count('pk')).values_list('image', 'refs').iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0013_image_dimensions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('name', models.CharField(help_text='Имя файла в хранилище, получено из хеша содержимого', max_length=255, primary_key=True, serialize=False, verbose_name='Файл')),
+                ('refs', models.PositiveIntegerField(default=0, help_text='Число сообщений с этим файлом', verbose_name='Ссылок')),
+            ],
+            options={
+                'verbose_name': 'blob',
+                'verbose_name_plural': 'blobs',
+            },
+        ),
+        migrations.RunPython(fill_blobs, migrations.RunPython.noop),
+    ]
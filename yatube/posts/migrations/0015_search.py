@@ -0,0 +1,44 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:31
+
+from django.db import migrations, transaction
+from django.db.utils import OperationalError
+
+
+def create_index(apps, schema_editor):
+    """Индекс FTS5 создается, только если SQLite собран с ним"""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            with transaction.atomic(using=schema_editor.connection.alias):
+                cursor.execute(
+                    'CREATE VIRTUAL TABLE posts_search USING fts5('
+                    "body, post_id UNINDEXED, prefix='2 3', "
+                    "tokenize='unicode61 remove_diacritics 2')"
+                )
+        except OperationalError:
+            return
+        cursor.execute(
+            'INSERT INTO posts_search (rowid, body, post_id) '
+            'SELECT id * 2, text, id FROM posts_post'
+        )
+        cursor.execute(
+            'INSERT INTO posts_search (rowid, body, post_id) '
+            'SELECT id * 2 + 1, text, post_id FROM posts_comment'
+        )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS posts_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0014_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
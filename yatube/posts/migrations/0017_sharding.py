@@ -0,0 +1,38 @@
+# Generated by Django 2.2.16 on 2026-10-18 20:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('posts', '0016_comment_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthorShard',
+            fields=[
+                ('user', models.OneToOneField(help_text='Автор, сообщения которого перенесены на другой шард', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='shard', serialize=False, to=settings.AUTH_USER_MODEL, verbose_name='Автор')),
+                ('alias', models.CharField(help_text='Псевдоним базы из SHARDS с сообщениями автора', max_length=100, verbose_name='Шард')),
+            ],
+            options={
+                'verbose_name': 'author shard',
+                'verbose_name_plural': 'author shards',
+            },
+        ),
+        migrations.CreateModel(
+            name='ShardSequence',
+            fields=[
+                ('name', models.CharField(help_text='Модель, для которой шард выдает id', max_length=100, primary_key=True, serialize=False, verbose_name='Модель')),
+                ('value', models.BigIntegerField(default=0, help_text='Последний выданный номер на этом шарде', verbose_name='Номер')),
+            ],
+            options={
+                'verbose_name': 'shard sequence',
+                'verbose_name_plural': 'shard sequences',
+            },
+        ),
+    ]
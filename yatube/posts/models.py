@@ -1,10 +1,60 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, models, router, transaction
 
 User = get_user_model()
 
 
-class Post(models.Model):
+class RoutedQuerySet(models.QuerySet):
+    """create() без using() выбирает базу по объекту.
+
+    QuerySet.create передает save() базу, выбранную без объекта, и
+    роутер шардов не видит автора сообщения.
+    """
+
+    def create(self, **kwargs):
+        obj = self.model(**kwargs)
+        self._for_write = True
+        obj.save(force_insert=True, using=self._db)
+        return obj
+
+
+class CountedModel(models.Model):
+    """Строка, чья запись двигает счетчики в обработчиках сигналов.
+
+    Запись и обработчики post_save и post_delete идут в одной
+    транзакции: сбой между ними не оставит счетчики неверными.
+    Счетчики лежат в default, строка может лежать на шарде.
+    """
+
+    class Meta:
+        abstract = True
+
+    def atomic(self, using):
+        using = using or router.db_for_write(type(self), instance=self)
+        return transaction.atomic(using=using), transaction.atomic(
+            using=DEFAULT_DB_ALIAS, savepoint=False
+        )
+
+    def save(self, *args, **kwargs):
+        # Роутер шардов ищет шард автора запросом: база выбирается раз
+        kwargs['using'] = kwargs.get('using') or router.db_for_write(
+            type(self), instance=self
+        )
+        if self._state.adding and self.pk is None:
+            # id на шарде выдаст pre_save, UPDATE по нему перед INSERT
+            # был бы лишним запросом
+            kwargs.setdefault('force_insert', True)
+        own, counters = self.atomic(kwargs['using'])
+        with own, counters:
+            super().save(*args, **kwargs)
+
+    def delete(self, using=None, keep_parents=False):
+        own, counters = self.atomic(using or self._state.db)
+        with own, counters:
+            return super().delete(using, keep_parents)
+
+
+class Post(CountedModel):
     text = models.TextField(
         verbose_name='Сообщение',
         help_text='Текст сообщения'
@@ -36,9 +86,45 @@ class Post(models.Model):
         verbose_name='Картинка',
         help_text='Картинка для сообщения'
     )
+    image_width = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Ширина картинки',
+        help_text='Ширина оригинала картинки в пикселях'
+    )
+    image_height = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        verbose_name='Высота картинки',
+        help_text='Высота оригинала картинки в пикселях'
+    )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Комментариев',
+        help_text='Число комментариев к сообщению'
+    )
+
+    objects = RoutedQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(
+                fields=('-pub_date', '-id'),
+                name='post_date_idx'
+            ),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='post_author_date_idx'
+            ),
+            models.Index(
+                fields=('group', '-pub_date', '-id'),
+                name='post_group_date_idx'
+            ),
+        )
 
     def __str__(self):
         return self.text[:30]
@@ -60,12 +146,18 @@ class Group(models.Model):
         verbose_name='Описание',
         help_text='Описание группы'
     )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Сообщений',
+        help_text='Число сообщений в группе'
+    )
 
     def __str__(self):
         return self.title
 
 
-class Comment(models.Model):
+class Comment(CountedModel):
     post = models.ForeignKey(
         Post,
         on_delete=models.CASCADE,
@@ -91,16 +183,28 @@ class Comment(models.Model):
         help_text='Дата публикации комментария'
     )
 
+    objects = RoutedQuerySet.as_manager()
+
     class Meta:
         ordering = ('-created',)
         verbose_name = 'comment'
         verbose_name_plural = 'comments'
+        indexes = (
+            models.Index(
+                fields=('post', '-created', '-id'),
+                name='comment_post_created_idx'
+            ),
+            models.Index(
+                fields=('-created', '-id'),
+                name='comment_created_idx'
+            ),
+        )
 
     def __str__(self):
         return self.text[:15]
 
 
-class Follow(models.Model):
+class Follow(CountedModel):
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -125,6 +229,151 @@ class Follow(models.Model):
                 name='unique_pair'
             ),
         )
+        indexes = (
+            models.Index(
+                fields=('author', 'user'),
+                name='follow_author_user_idx'
+            ),
+        )
 
     def __str__(self):
         return f'{self.user}, {self.author}'
+
+
+class Timeline(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик',
+        help_text='Владелец ленты'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Сообщение',
+        help_text='Сообщение в ленте подписчика'
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+        help_text='Копия даты публикации сообщения'
+    )
+
+    class Meta:
+        ordering = ('-pub_date',)
+        verbose_name = 'timeline'
+        verbose_name_plural = 'timelines'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'post'),
+                name='unique_timeline_post'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('user', '-pub_date', '-post'),
+                name='timeline_user_date_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user}, {self.post_id}'
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь',
+        help_text='Владелец счетчиков'
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Сообщений',
+        help_text='Число сообщений пользователя'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчиков',
+        help_text='Число подписчиков пользователя'
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписок',
+        help_text='Число авторов, на которых подписан пользователь'
+    )
+
+    class Meta:
+        verbose_name = 'user stats'
+        verbose_name_plural = 'user stats'
+
+    def __str__(self):
+        return str(self.user_id)
+
+
+class Blob(models.Model):
+    name = models.CharField(
+        max_length=255,
+        primary_key=True,
+        verbose_name='Файл',
+        help_text='Имя файла в хранилище, получено из хеша содержимого'
+    )
+    refs = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Ссылок',
+        help_text='Число сообщений с этим файлом'
+    )
+
+    class Meta:
+        verbose_name = 'blob'
+        verbose_name_plural = 'blobs'
+
+    def __str__(self):
+        return self.name
+
+
+class AuthorShard(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='shard',
+        verbose_name='Автор',
+        help_text='Автор, сообщения которого перенесены на другой шард'
+    )
+    alias = models.CharField(
+        max_length=100,
+        verbose_name='Шард',
+        help_text='Псевдоним базы из SHARDS с сообщениями автора'
+    )
+
+    class Meta:
+        verbose_name = 'author shard'
+        verbose_name_plural = 'author shards'
+
+    def __str__(self):
+        return f'{self.user_id}: {self.alias}'
+
+
+class ShardSequence(models.Model):
+    name = models.CharField(
+        max_length=100,
+        primary_key=True,
+        verbose_name='Модель',
+        help_text='Модель, для которой шард выдает id'
+    )
+    value = models.BigIntegerField(
+        default=0,
+        verbose_name='Номер',
+        help_text='Последний выданный номер на этом шарде'
+    )
+
+    class Meta:
+        verbose_name = 'shard sequence'
+        verbose_name_plural = 'shard sequences'
+
+    def __str__(self):
+        return f'{self.name}: {self.value}'
@@ -0,0 +1,225 @@
+import base64
+import binascii
+import hashlib
+from math import ceil
+
+from django.conf import settings as s
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction, number, obj, key, tie='pk'):
+    """Упаковываем позицию в непрозрачную строку для ссылки"""
+    value = getattr(obj, key).isoformat() if key else ''
+    raw = f'{direction}|{number}|{value}|{getattr(obj, tie)}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Распаковываем позицию, ValueError для испорченной строки"""
+    try:
+        raw = base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)
+        ).decode()
+        direction, number, raw_value, pk = raw.split('|')
+        value = parse_datetime(raw_value) if raw_value else None
+        number, pk = int(number), int(pk)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError('Invalid cursor')
+    if (
+        direction not in (NEXT, PREVIOUS)
+        or (raw_value and value is None)
+        or number < 1
+    ):
+        raise ValueError('Invalid cursor')
+    return direction, number, value, pk
+
+
+class CursorPaginator(Paginator):
+    """Перелистыватель по ключу (key, pk) без OFFSET и COUNT.
+
+    Страница читает на одну запись больше, чтобы узнать о следующей,
+    а с window > 1 - еще window - 1 страниц вперед: их курсоры дают
+    окно ссылок на страницы. Номер страницы переносится в курсоре,
+    поэтому Page и шаблон перелистывателя работают как с обычным
+    Paginator. Общее число записей total берется снаружи (кэш,
+    счетчики) и нужно только для номера последней страницы, которая
+    читается с конца списка. key=None листает только по tie. tie -
+    уникальное в списке поле, различающее записи с одним key: по
+    умолчанию pk, у ленты подписок - post_id.
+    """
+
+    def __init__(self, object_list, per_page, key='pub_date', total=None,
+                 window=1, tie='pk', **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.key = key
+        self.tie = tie
+        self.total = total
+        self.window = window
+        self._num_pages = 1
+        self._count = 0
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def num_pages(self):
+        return self._num_pages
+
+    @property
+    def total_pages(self):
+        if self.total is None:
+            return None
+        return max(ceil(self.total / self.per_page), self._num_pages)
+
+    def get_page(self, number=None, cursor=None):
+        if cursor:
+            try:
+                return self.page_by_cursor(*decode_cursor(cursor))
+            except ValueError:
+                pass
+        if number == 'last':
+            return self.last_page()
+        try:
+            number = max(int(number), 1)
+        except (TypeError, ValueError):
+            number = 1
+        return self.page_by_number(number)
+
+    def page_by_number(self, number):
+        """Прямой переход по ?page=N для старых ссылок"""
+        bottom = (number - 1) * self.per_page
+        rows = list(self.ordered()[bottom:bottom + self.ahead()])
+        if not rows and number > 1:
+            return self.page_by_number(1)
+        return self.build_page(rows, number, len(rows) > self.per_page)
+
+    def last_page(self):
+        """Последняя страница: первые записи в обратном порядке.
+
+        По total на ней остаток от деления на страницы, и номера
+        соседних страниц совпадают с переходами с начала списка.
+        """
+        last = self.total_pages
+        size = self.per_page
+        if last:
+            size = self.total - (last - 1) * self.per_page or size
+        rows = list(self.reversed()[:size + 1])
+        number = max(last or 1, 2) if len(rows) > size else 1
+        rows = rows[:size]
+        rows.reverse()
+        return self.build_page(rows, number, False)
+
+    def after(self, lookup, value, pk):
+        """Условие на записи после позиции (value, pk) по lookup"""
+        if self.key is None:
+            return Q(**{f'{self.tie}__{lookup}': pk})
+        return (
+            Q(**{f'{self.key}__{lookup}': value})
+            | Q(**{self.key: value, f'{self.tie}__{lookup}': pk})
+        )
+
+    def page_by_cursor(self, direction, number, value, pk):
+        if (value is None) != (self.key is None):
+            raise ValueError('Cursor of another list')
+        if direction == NEXT:
+            rows = list(self.ordered().filter(
+                self.after('lt', value, pk)
+            )[:self.ahead()])
+            return self.build_page(rows, number, len(rows) > self.per_page)
+        rows = list(self.reversed().filter(
+            self.after('gt', value, pk)
+        )[:self.per_page + 1])
+        if len(rows) <= self.per_page:
+            number = 1
+        rows = rows[:self.per_page]
+        rows.reverse()
+        return self.build_page(rows, number, True)
+
+    def ahead(self):
+        """Сколько записей читать от начала страницы"""
+        return self.per_page * self.window + 1
+
+    def ordered(self):
+        if self.key is None:
+            return self.object_list.order_by(f'-{self.tie}')
+        return self.object_list.order_by(f'-{self.key}', f'-{self.tie}')
+
+    def reversed(self):
+        if self.key is None:
+            return self.object_list.order_by(self.tie)
+        return self.object_list.order_by(self.key, self.tie)
+
+    def build_page(self, rows, number, has_next):
+        """rows - записи страницы и прочитанные после нее"""
+        page = Page(rows[:self.per_page], number, self)
+        page.previous_cursor = None
+        if number > 1 and rows:
+            page.previous_cursor = encode_cursor(
+                PREVIOUS, number - 1, rows[0], self.key, self.tie
+            )
+        following = []
+        while has_next and rows and len(following) < self.window:
+            end = min((len(following) + 1) * self.per_page, len(rows))
+            following.append((
+                number + len(following) + 1,
+                encode_cursor(
+                    NEXT, number + len(following) + 1, rows[end - 1],
+                    self.key, self.tie
+                )
+            ))
+            has_next = len(rows) > end + self.per_page
+        page.next_cursor = following[0][1] if following else None
+        page.page_window = (
+            [(number - 1, page.previous_cursor)] if page.previous_cursor
+            else []
+        ) + [(number, None)] + following
+        self._num_pages = page.page_window[-1][0]
+        self._count = (number - 1) * self.per_page + len(rows)
+        return page
+
+
+def cached_count(name, queryset):
+    """Число записей списка, пересчитывается не чаще раза в таймаут"""
+    return cache.get_or_set(
+        f'paginator_count:{name}',
+        queryset.count,
+        s.PAGINATOR_COUNT_TIMEOUT
+    )
+
+
+class CachedCountPaginator(Paginator):
+    """Paginator, берущий число строк запроса из кэша"""
+
+    @cached_property
+    def count(self):
+        query = self.object_list.query
+        try:
+            sql = repr(query.sql_with_params())
+        except EmptyResultSet:
+            return 0
+        digest = hashlib.md5(sql.encode()).hexdigest()
+        return cached_count(
+            f'{query.model._meta.label}:{digest}', self.object_list
+        )
+
+
+def paginate(request, object_list, key='pub_date', total=None,
+             per_page=None, tie='pk'):
+    """Страница списка по параметрам ?cursor= или ?page= запроса"""
+    paginator = CursorPaginator(
+        object_list, per_page or s.NUMBER_MESSAGES, key=key, total=total,
+        window=s.PAGINATOR_WINDOW, tie=tie
+    )
+    return paginator.get_page(
+        request.GET.get('page'),
+        request.GET.get('cursor')
+    )
@@ -0,0 +1,227 @@
+"""Полнотекстовый поиск по сообщениям и комментариям.
+
+Обратный индекс - виртуальная таблица SQLite FTS5 posts_search со
+строкой на сообщение (rowid = 2 * id) и на комментарий
+(rowid = 2 * id + 1). Сигналы меняют строки при записи и удалении,
+rebuild_index заполняет таблицу заново после массовой загрузки, при
+шардах - строками со всех шардов.
+Сообщение ранжируется по лучшей из своих строк по bm25, совпадение
+в комментарии весит вдвое меньше. Страницы листаются по ключу
+(оценка, id) без OFFSET. Если база без FTS5, поиск идет через LIKE
+и листается по дате.
+"""
+import base64
+import binascii
+import re
+
+from django.conf import settings as s
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from posts.models import Comment, Post
+from posts.paginators import CursorPaginator
+from posts.sharding import each, in_bulk, scatter, sharded
+
+TABLE = 'posts_search'
+COMMENT_WEIGHT = 0.5
+
+_available = {}
+
+
+def available():
+    """Есть ли таблица индекса в текущей базе"""
+    name = connection.settings_dict['NAME']
+    if name not in _available:
+        _available[name] = (
+            connection.vendor == 'sqlite'
+            and TABLE in connection.introspection.table_names()
+        )
+    return _available[name]
+
+
+def execute(sql, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+
+
+def index_post(post):
+    if available():
+        execute(
+            f'INSERT OR REPLACE INTO {TABLE} (rowid, body, post_id) '
+            'VALUES (%s, %s, %s)',
+            (post.pk * 2, post.text, post.pk)
+        )
+
+
+def index_comment(comment):
+    if available():
+        execute(
+            f'INSERT OR REPLACE INTO {TABLE} (rowid, body, post_id) '
+            'VALUES (%s, %s, %s)',
+            (comment.pk * 2 + 1, comment.text, comment.post_id)
+        )
+
+
+def unindex_post(pk):
+    if available():
+        execute(f'DELETE FROM {TABLE} WHERE rowid = %s', (pk * 2,))
+
+
+def unindex_comment(pk):
+    if available():
+        execute(f'DELETE FROM {TABLE} WHERE rowid = %s', (pk * 2 + 1,))
+
+
+def insert_rows(rows):
+    """Строки (rowid, текст, id сообщения) с шарда в индекс default"""
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'INSERT INTO {TABLE} (rowid, body, post_id) '
+            'VALUES (%s, %s, %s)',
+            rows
+        )
+
+
+def rebuild_index():
+    """Заполняем индекс заново, возвращаем число строк"""
+    if not available():
+        return 0
+    execute(f'DELETE FROM {TABLE}')
+    if sharded(Post):
+        for posts in each(Post.objects.all()):
+            insert_rows(
+                (pk * 2, text, pk)
+                for pk, text in posts.values_list('pk', 'text').iterator()
+            )
+        for comments in each(Comment.objects.all()):
+            insert_rows(
+                (pk * 2 + 1, text, post_id)
+                for pk, text, post_id in comments.values_list(
+                    'pk', 'text', 'post_id'
+                ).iterator()
+            )
+    else:
+        execute(
+            f'INSERT INTO {TABLE} (rowid, body, post_id) '
+            'SELECT id * 2, text, id FROM posts_post'
+        )
+        execute(
+            f'INSERT INTO {TABLE} (rowid, body, post_id) '
+            'SELECT id * 2 + 1, text, post_id FROM posts_comment'
+        )
+    execute(f"INSERT INTO {TABLE} ({TABLE}) VALUES ('optimize')")
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT count(*) FROM {TABLE}')
+        return cursor.fetchone()[0]
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())[:s.SEARCH_MAX_TERMS]
+
+
+def match_expression(words):
+    """Все слова запроса, каждое как начало слова в тексте"""
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def matching_ids(model, query):
+    """Подзапрос id сообщений или комментариев со всеми словами query"""
+    remainder = 0 if model is Post else 1
+    return RawSQL(
+        f'SELECT (rowid - {remainder}) / 2 FROM {TABLE} '
+        f'WHERE {TABLE} MATCH %s AND rowid %% 2 = {remainder}',
+        (match_expression(terms(query)),)
+    )
+
+
+def encode_cursor(number, score, pk):
+    raw = f'{number}|{score!r}|{pk}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Номер страницы, оценка и id, ValueError для испорченной строки"""
+    try:
+        raw = base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)
+        ).decode()
+        number, score, pk = raw.split('|')
+        return int(number), float(score), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError('Invalid cursor')
+
+
+class ResultPage:
+    """Страница результатов: сообщения и курсор следующей"""
+
+    def __init__(self, posts, number, next_cursor=None):
+        self.object_list = posts
+        self.number = number
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def ranked(words, limit, after=None):
+    """Пары (id сообщения, оценка) по возрастанию оценки bm25"""
+    score, pk = after or (float('-inf'), 0)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT post_id, MIN(weighted) AS score FROM ('
+            '  SELECT post_id, rank * CASE rowid %% 2 WHEN 0 THEN 1.0'
+            f'  ELSE {COMMENT_WEIGHT} END AS weighted'
+            f'  FROM {TABLE} WHERE {TABLE} MATCH %s'
+            ') GROUP BY post_id '
+            'HAVING score > %s OR (score = %s AND post_id > %s) '
+            'ORDER BY score, post_id LIMIT %s',
+            (match_expression(words), score, score, pk, limit)
+        )
+        return cursor.fetchall()
+
+
+def search(query, cursor=None, per_page=None):
+    """Страница результатов поиска query"""
+    per_page = per_page or s.NUMBER_MESSAGES
+    words = terms(query)
+    if not words:
+        return ResultPage([], 1)
+    if not available():
+        return search_like(words, cursor, per_page)
+    number, after = 1, None
+    if cursor:
+        try:
+            number, score, pk = decode_cursor(cursor)
+            after = score, pk
+        except ValueError:
+            pass
+    hits = ranked(words, per_page + 1, after)
+    posts = in_bulk(
+        Post.objects.select_related('author', 'group'),
+        [pk for pk, _ in hits[:per_page]]
+    )
+    page = ResultPage(
+        [posts[pk] for pk, _ in hits[:per_page] if pk in posts], number
+    )
+    if len(hits) > per_page:
+        pk, score = hits[per_page - 1]
+        page.next_cursor = encode_cursor(number + 1, score, pk)
+    return page
+
+
+def search_like(words, cursor, per_page):
+    """Запасной поиск без индекса: LIKE по тексту, новые сверху"""
+    condition = Q()
+    for word in words:
+        condition &= (
+            Q(text__icontains=word) | Q(comments__text__icontains=word)
+        )
+    posts = scatter(Post.objects.select_related('author', 'group').filter(
+        pk__in=Post.objects.filter(condition).values('pk')
+    ))
+    page = CursorPaginator(posts, per_page).get_page(cursor=cursor)
+    return ResultPage(list(page), page.number, page.next_cursor)
@@ -0,0 +1,433 @@
+"""Сообщения и комментарии на нескольких базах по автору.
+
+Включается списком псевдонимов баз SHARDS. Сообщения автора живут на
+одном шарде: по умолчанию SHARDS[id автора % N], а перенесенные
+rebalance_shards авторы записаны в AuthorShard. Комментарии лежат
+рядом со своим сообщением. Пользователи, группы, подписки, счетчики
+и поиск остаются в default.
+
+Id выдает шард: номер из его ShardSequence, умноженный на
+SHARD_ID_STRIDE, плюс порядковый номер шарда. Id не совпадают между
+шардами, и по id видно, где строка создана. После переноса автора
+строка ищется и на остальных шардах.
+
+ShardRouter направляет запись и чтение по связанному объекту.
+Списки по нескольким авторам (лента, группа, подписки) читает
+Scatter: каждый шард отдает первые строки в нужном порядке, и они
+сливаются по ключу сортировки.
+"""
+import heapq
+from itertools import islice
+from operator import attrgetter
+
+from django.conf import settings as s
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import F, Max, prefetch_related_objects
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from posts.models import AuthorShard, Comment, Post, ShardSequence, Timeline
+from posts.models import User, UserStats
+
+
+def enabled():
+    return bool(s.SHARDS)
+
+
+def sharded(model):
+    return enabled() and model in (Post, Comment)
+
+
+def hashed(author_id):
+    return s.SHARDS[author_id % len(s.SHARDS)]
+
+
+def shard_for(author_id):
+    """Шард с сообщениями автора"""
+    alias = AuthorShard.objects.filter(user_id=author_id).values_list(
+        'alias', flat=True
+    ).first()
+    return alias if alias in s.SHARDS else hashed(author_id)
+
+
+def shards_for(author_ids):
+    """Авторы, разложенные по шардам: {шард: [id автора]}"""
+    moved = dict(AuthorShard.objects.filter(
+        user_id__in=author_ids
+    ).values_list('user_id', 'alias'))
+    result = {}
+    for author_id in author_ids:
+        alias = moved.get(author_id)
+        if alias not in s.SHARDS:
+            alias = hashed(author_id)
+        result.setdefault(alias, []).append(author_id)
+    return result
+
+
+def place(author_id, alias):
+    """Записываем новое место автора"""
+    if alias == hashed(author_id):
+        AuthorShard.objects.filter(user_id=author_id).delete()
+    else:
+        AuthorShard.objects.update_or_create(
+            user_id=author_id, defaults={'alias': alias}
+        )
+
+
+def number(alias):
+    if len(s.SHARDS) >= s.SHARD_ID_STRIDE:
+        raise ImproperlyConfigured('SHARDS longer than SHARD_ID_STRIDE')
+    return s.SHARDS.index(alias) + 1
+
+
+def home(pk):
+    """Шард, выдавший id, или None для id не из шардов"""
+    index = pk % s.SHARD_ID_STRIDE
+    return s.SHARDS[index - 1] if 0 < index <= len(s.SHARDS) else None
+
+
+def advance(model, alias, floor):
+    """Номер последовательности не меньше floor.
+
+    Нужен, когда на шард приходят строки с чужими id: номер выше
+    их id не даст выдать такой же.
+    """
+    sequences = ShardSequence.objects.using(alias)
+    name = model._meta.label_lower
+    if not sequences.filter(name=name, value__lt=floor).update(value=floor):
+        sequences.get_or_create(name=name, defaults={'value': floor})
+
+
+def next_id(model, alias):
+    """Новый id строки model на шарде alias"""
+    sequences = ShardSequence.objects.using(alias)
+    name = model._meta.label_lower
+    with transaction.atomic(using=alias):
+        # UPDATE первым берет блокировку записи до конца транзакции
+        if not sequences.filter(name=name).update(value=F('value') + 1):
+            top = model._base_manager.using(alias).aggregate(
+                top=Max('pk')
+            )['top'] or 0
+            sequences.create(name=name, value=top // s.SHARD_ID_STRIDE + 1)
+        value = sequences.values_list('value', flat=True).get(name=name)
+    return value * s.SHARD_ID_STRIDE + number(alias)
+
+
+def related_paths(tree, prefix=''):
+    """Пути prefetch для дерева select_related"""
+    paths = []
+    for name, children in tree.items():
+        path = f'{prefix}{name}'
+        paths.extend(related_paths(children, f'{path}__') or [path])
+    return paths
+
+
+def linked(rows, name):
+    """Есть ли у строк объект по связи name.
+
+    prefetch по одним NULL все равно сходил бы в базу.
+    """
+    if not rows:
+        return False
+    attname = rows[0]._meta.get_field(name).attname
+    return any(getattr(row, attname) is not None for row in rows)
+
+
+def sort_key(queryset):
+    """Ключ слияния и обратный ли порядок по сортировке queryset"""
+    query = queryset.query
+    fields = query.order_by or (
+        queryset.model._meta.ordering if query.default_ordering else ()
+    )
+    if not fields or not all(isinstance(field, str) for field in fields):
+        raise ValueError('Scatter needs ordering by field names')
+    directions = {field.startswith('-') for field in fields}
+    if len(directions) > 1:
+        raise ValueError('Scatter needs one direction for all fields')
+    names = [
+        'pk' if name in ('pk', 'id') else name
+        for name in (field.lstrip('-') for field in fields)
+    ]
+    return attrgetter(*names), directions.pop()
+
+
+class Scatter:
+    """Один список, собранный из querysets нескольких шардов.
+
+    Умеет то, что нужно CursorPaginator: filter, order_by, срезы и
+    count. select_related на шарде не работает - пользователи и
+    группы в другой базе, поэтому связи догружаются одним prefetch
+    на всю страницу.
+    """
+    ordered = True
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def filter(self, *args, **kwargs):
+        return Scatter([part.filter(*args, **kwargs) for part in self.parts])
+
+    def order_by(self, *fields):
+        return Scatter([part.order_by(*fields) for part in self.parts])
+
+    def count(self):
+        return sum(part.count() for part in self.parts)
+
+    def exists(self):
+        return any(part.exists() for part in self.parts)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step is not None or (key.start or 0) < 0:
+                raise ValueError('Scatter supports only plain slices')
+            return self.fetch(key.start or 0, key.stop)
+        return self.fetch(key, key + 1)[0]
+
+    def __iter__(self):
+        return iter(self.fetch(0, None))
+
+    def fetch(self, start, stop):
+        if not self.parts:
+            return []
+        related = self.parts[0].query.select_related
+        rows = [part.select_related(None) for part in self.parts]
+        if len(rows) == 1:
+            # Один шард сливать не с чем, а ключ сортировки может
+            # быть отложенным полем only()
+            rows = list(rows[0][start:stop])
+        else:
+            key, reverse = sort_key(self.parts[0])
+            if stop is not None:
+                rows = [part[:stop] for part in rows]
+            rows = list(islice(
+                heapq.merge(*rows, key=key, reverse=reverse), start, stop
+            ))
+        if isinstance(related, dict):
+            prefetch_related_objects(rows, *[
+                path for path in related_paths(related)
+                if linked(rows, path.split('__')[0])
+            ])
+        return rows
+
+
+def scatter(queryset):
+    """Список с тех шардов, где могут быть его строки"""
+    if not sharded(queryset.model):
+        return queryset
+    alias = queryset.db
+    aliases = [alias] if alias in s.SHARDS else s.SHARDS
+    return Scatter([queryset.using(alias) for alias in aliases])
+
+
+def for_authors(queryset, author_ids):
+    """Строки queryset нескольких авторов, каждый шард - со своими"""
+    return Scatter([
+        queryset.using(alias).filter(author_id__in=ids)
+        for alias, ids in shards_for(list(author_ids)).items()
+    ])
+
+
+def unsharded(action):
+    """Отказ запускать код, который читает и пишет только default.
+
+    При SHARDS он молча пропустил бы сообщения на шардах.
+    """
+    if enabled():
+        raise ImproperlyConfigured(
+            f'{action} works only without SHARDS: run it on an unsharded '
+            'default, then rebalance_shards --from-default'
+        )
+
+
+def each(queryset):
+    """queryset на каждом шарде, без шардов - он сам"""
+    if not sharded(queryset.model):
+        return [queryset]
+    return [queryset.using(alias) for alias in s.SHARDS]
+
+
+def lookup(queryset, pk):
+    """Объект по id или None: сначала на шарде, выдавшем id"""
+    if not sharded(queryset.model):
+        return queryset.filter(pk=pk).first()
+    origin = home(pk)
+    for alias in sorted(s.SHARDS, key=lambda alias: alias != origin):
+        found = Scatter([queryset.using(alias).filter(pk=pk)])[:1]
+        if found:
+            return found[0]
+    return None
+
+
+def get_or_404(queryset, pk):
+    """get_object_or_404 по id с учетом шардов"""
+    if not sharded(queryset.model):
+        return get_object_or_404(queryset, pk=pk)
+    obj = lookup(queryset, pk)
+    if obj is None:
+        raise Http404(f'No {queryset.model._meta.object_name} {pk}')
+    return obj
+
+
+def in_bulk(queryset, pks):
+    if not sharded(queryset.model):
+        return queryset.in_bulk(pks)
+    return {obj.pk: obj for obj in scatter(queryset.filter(pk__in=pks))}
+
+
+def route(model, instance):
+    """Шард для model по объекту из подсказок роутера"""
+    if isinstance(instance, User):
+        return shard_for(instance.pk) if model is Post else None
+    if not isinstance(instance, (Post, Comment)):
+        return None
+    if not instance._state.adding:
+        return instance._state.db if instance._state.db in s.SHARDS else None
+    # У новой строки _state.db мог выставить ее автор из default
+    if isinstance(instance, Post):
+        return instance.author_id and shard_for(instance.author_id)
+    if Comment.post.is_cached(instance):
+        return route(Post, instance.post)
+    if instance.post_id is None:
+        return None
+    post = lookup(Post.objects.only('pk'), instance.post_id)
+    return post and post._state.db
+
+
+class ShardRouter:
+    """Сообщения и комментарии - на шард автора сообщения.
+
+    Без объекта в подсказках (Post.objects.filter(...)) роутер молчит
+    и чтение идет в default: такие списки читаются через scatter.
+    """
+
+    def db_for_read(self, model, **hints):
+        if sharded(model):
+            return route(model, hints.get('instance'))
+        return None
+
+    def db_for_write(self, model, **hints):
+        return self.db_for_read(model, **hints)
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == DEFAULT_DB_ALIAS or db not in s.SHARDS:
+            return None
+        # Таблицы posts нужны каскадному удалению, данные - только
+        # сообщений и комментариев
+        return app_label == 'posts' and model_name is not None
+
+
+def chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def insert_raw(model, alias, rows):
+    """Строки как есть, уже существующие пропускаются.
+
+    bulk_create заново проставил бы даты auto_now_add.
+    """
+    rows = list(rows)
+    fields = model._meta.concrete_fields
+    size = connections[alias].ops.bulk_batch_size(fields, rows)
+    for part in chunks(rows, max(size, 1)):
+        model._base_manager._insert(
+            part, fields=fields, raw=True, using=alias,
+            ignore_conflicts=True
+        )
+
+
+def copy_author(author_id, source, target, batch):
+    """Копируем строки автора, уже скопированные пропускаются"""
+    ids = list(Post.objects.using(source).filter(
+        author_id=author_id
+    ).values_list('pk', flat=True))
+    with transaction.atomic(using=target):
+        for part in chunks(ids, batch):
+            insert_raw(
+                Post, target, Post.objects.using(source).filter(pk__in=part)
+            )
+            insert_raw(
+                Comment, target,
+                Comment.objects.using(source).filter(post_id__in=part)
+            )
+        for model in (Post, Comment):
+            top = model._base_manager.using(target).aggregate(
+                top=Max('pk')
+            )['top']
+            if top is not None:
+                advance(model, target, top // s.SHARD_ID_STRIDE + 1)
+    return ids
+
+
+def delete_author(ids, source, batch):
+    with transaction.atomic(using=source):
+        for part in chunks(ids, batch):
+            # Без сигналов: счетчики и поиск от переноса не меняются
+            for queryset in (
+                Comment.objects.filter(post_id__in=part),
+                Timeline.objects.filter(post_id__in=part),
+                Post.objects.filter(pk__in=part),
+            ):
+                queryset.using(source)._raw_delete(source)
+
+
+def move_author(author_id, source, target, batch=500):
+    """Переносим сообщения автора и комментарии к ним на target.
+
+    Строки копируются с прежними id, затем меняется место автора,
+    докопируются строки, созданные за это время, и только потом
+    строки удаляются из source. Правки старых строк во время
+    переноса могут потеряться. Возвращаем число сообщений.
+    """
+    copy_author(author_id, source, target, batch)
+    place(author_id, target)
+    ids = copy_author(author_id, source, target, batch)
+    delete_author(ids, source, batch)
+    return len(ids)
+
+
+def loads():
+    """{id автора: (шард, число сообщений)} для авторов с сообщениями"""
+    counts = dict(UserStats.objects.filter(
+        posts_count__gt=0
+    ).values_list('user_id', 'posts_count'))
+    return {
+        author_id: (alias, counts[author_id])
+        for alias, ids in shards_for(list(counts)).items()
+        for author_id in ids
+    }
+
+
+def plan(authors, tolerance=0.1):
+    """Переносы (автор, откуда, куда), выравнивающие число сообщений.
+
+    Пока разница самого полного и самого пустого шарда больше
+    tolerance от среднего, с полного на пустой переезжает самый
+    крупный автор, который не больше половины разницы.
+    """
+    totals = dict.fromkeys(s.SHARDS, 0)
+    for alias, posts in authors.values():
+        totals[alias] += posts
+    allowed = tolerance * sum(totals.values()) / len(totals)
+    placed = {author_id: alias for author_id, (alias, _) in authors.items()}
+    while True:
+        heavy = max(totals, key=totals.get)
+        light = min(totals, key=totals.get)
+        gap = totals[heavy] - totals[light]
+        fitting = [
+            (posts, author_id)
+            for author_id, (_, posts) in authors.items()
+            if placed[author_id] == heavy and posts <= gap // 2
+        ]
+        if gap <= allowed or not fitting:
+            break
+        posts, author_id = max(fitting)
+        placed[author_id] = light
+        totals[heavy] -= posts
+        totals[light] += posts
+    return [
+        (author_id, alias, placed[author_id])
+        for author_id, (alias, _) in authors.items()
+        if placed[author_id] != alias
+    ]
@@ -0,0 +1,327 @@
+from django.conf import settings as s
+from django.db.models.signals import post_delete, post_init, post_save
+from django.db.models.signals import pre_delete, pre_save
+from django.db import connection, transaction
+from django.dispatch import receiver
+
+from posts.counters import bump, bump_user
+from posts.events import comment_event, post_event, publish
+from posts.fragments import bump_version
+from posts.media import acquire, release
+from posts.models import Post, Group, User, Comment, Follow, Timeline
+from posts.models import UserStats
+from posts.search import index_comment, index_post, unindex_comment
+from posts.search import unindex_post
+from posts.sharding import each, next_id, sharded
+from posts.thumbnails import schedule_post
+
+
+def trim_timelines(users):
+    """Оставляем в лентах не больше TIMELINE_LENGTH последних записей.
+
+    users - queryset с id владельцев лент. Все ленты режутся одним
+    DELETE, записи нумеруются по (pub_date, post_id): сообщения с
+    одной датой не выводят ленту за предел.
+    """
+    users, params = users.order_by().query.sql_with_params()
+    table = Timeline._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE id IN ('
+            f'SELECT id FROM ('
+            f'SELECT id, ROW_NUMBER() OVER ('
+            f'PARTITION BY user_id ORDER BY pub_date DESC, post_id DESC'
+            f') AS position FROM {table} WHERE user_id IN ({users})'
+            f') AS ranked WHERE position > %s)',
+            [*params, s.TIMELINE_LENGTH]
+        )
+
+
+def fill_timeline(user_id, author_id):
+    """Переносим в ленту последние записи автора"""
+    posts = Post.objects.filter(author_id=author_id).order_by(
+        '-pub_date', '-pk'
+    ).values_list('pk', 'pub_date')[:s.TIMELINE_LENGTH]
+    Timeline.objects.bulk_create(
+        (
+            Timeline(user_id=user_id, post_id=pk, pub_date=pub_date)
+            for pk, pub_date in posts
+        ),
+        ignore_conflicts=True
+    )
+    trim_timelines(User.objects.filter(pk=user_id).values('pk'))
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Comment)
+def shard_assign_id(sender, instance, using, **kwargs):
+    """id новой строки на шарде выдает сам шард"""
+    if instance.pk is None and sharded(sender) and using in s.SHARDS:
+        instance.pk = next_id(sender, using)
+
+
+@receiver(post_save, sender=Post)
+def post_fan_out(sender, instance, created, **kwargs):
+    """Раскладываем новую запись по лентам подписчиков автора.
+
+    С шардами лент нет: follow_index собирает сообщения с шардов.
+    """
+    if not created or sharded(sender):
+        return
+    followers = Follow.objects.filter(author_id=instance.author_id)
+    user_ids = list(followers.values_list('user_id', flat=True))
+    if not user_ids:
+        return
+    Timeline.objects.bulk_create(
+        Timeline(user_id=user_id, post=instance, pub_date=instance.pub_date)
+        for user_id in user_ids
+    )
+    trim_timelines(followers.values('user_id'))
+
+
+@receiver(post_save, sender=Follow)
+def follow_backfill(sender, instance, created, **kwargs):
+    """Заполняем ленту при подписке"""
+    if created and not sharded(Post):
+        fill_timeline(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_cleanup(sender, instance, **kwargs):
+    """Очищаем ленту от записей автора при отписке"""
+    Timeline.objects.filter(
+        user_id=instance.user_id,
+        post__author_id=instance.author_id
+    ).delete()
+
+
+@receiver(pre_delete, sender=User)
+def user_delete_sharded(sender, instance, **kwargs):
+    """Сообщения и комментарии автора на шардах.
+
+    CASCADE Django выполняет только в базе самого пользователя.
+    """
+    if not sharded(Post):
+        return
+    for comments in each(Comment.objects.filter(author_id=instance.pk)):
+        comments.delete()
+    for posts in each(Post.objects.filter(author_id=instance.pk)):
+        posts.delete()
+
+
+@receiver(pre_delete, sender=Group)
+def group_delete_sharded(sender, instance, **kwargs):
+    """SET_NULL для сообщений группы на шардах"""
+    if not sharded(Post):
+        return
+    for posts in each(Post.objects.filter(group_id=instance.pk)):
+        posts.update(group=None)
+
+
+@receiver(post_save, sender=User)
+def user_create_stats(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_init, sender=Post)
+def post_remember_group(sender, instance, **kwargs):
+    """Отложенное поле (only, defer) не дочитываем запросом"""
+    instance._saved_group_id = instance.__dict__.get('group_id')
+
+
+def image_name(value):
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=Post)
+def post_remember_image(sender, instance, **kwargs):
+    """None - картинка не загружена из базы (only, defer)"""
+    value = instance.__dict__.get('image')
+    instance._saved_image = None if value is None else image_name(value)
+
+
+@receiver(pre_save, sender=Post)
+def post_load_saved_image(sender, instance, **kwargs):
+    if instance._saved_image is None and not instance._state.adding:
+        instance._saved_image = image_name(Post.objects.using(
+            instance._state.db
+        ).filter(pk=instance.pk).values_list('image', flat=True).first())
+
+
+@receiver(pre_save, sender=Post)
+def post_reset_image_size(sender, instance, **kwargs):
+    """Размеры прежней картинки не подходят новой, их заполнит generate"""
+    if (
+        not instance._state.adding
+        and image_name(instance.image) != instance._saved_image
+    ):
+        instance.image_width = instance.image_height = None
+
+
+@receiver(post_save, sender=Post)
+def post_count_image(sender, instance, created, **kwargs):
+    """Сдвигаем ссылки на прежний и новый файлы картинки"""
+    old = '' if created else instance._saved_image
+    new = image_name(instance.image)
+    if old != new:
+        acquire(new)
+        release(old)
+
+
+@receiver(post_delete, sender=Post)
+def post_uncount_image(sender, instance, **kwargs):
+    release(image_name(instance.image))
+
+
+@receiver(post_save, sender=Post)
+def post_count(sender, instance, created, **kwargs):
+    """Обновляем счетчики сообщений автора и групп"""
+    old_group_id = None if created else instance._saved_group_id
+    if created:
+        bump_user(instance.author_id, posts_count=1)
+    if old_group_id != instance.group_id:
+        if old_group_id is not None:
+            bump(Group.objects.filter(pk=old_group_id), posts_count=-1)
+        if instance.group_id is not None:
+            bump(Group.objects.filter(pk=instance.group_id), posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def post_uncount(sender, instance, **kwargs):
+    bump_user(instance.author_id, posts_count=-1)
+    if instance._saved_group_id is not None:
+        bump(
+            Group.objects.filter(pk=instance._saved_group_id),
+            posts_count=-1
+        )
+
+
+@receiver(post_save, sender=Comment)
+def comment_count(sender, instance, created, using, **kwargs):
+    """Комментарий и его сообщение всегда в одной базе"""
+    if created:
+        bump(
+            Post.objects.using(using).filter(pk=instance.post_id),
+            comments_count=1
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def comment_uncount(sender, instance, using, **kwargs):
+    bump(
+        Post.objects.using(using).filter(pk=instance.post_id),
+        comments_count=-1
+    )
+
+
+@receiver(post_save, sender=Follow)
+def follow_count(sender, instance, created, **kwargs):
+    if created:
+        bump_user(instance.author_id, followers_count=1)
+        bump_user(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_uncount(sender, instance, **kwargs):
+    bump_user(instance.author_id, followers_count=-1)
+    bump_user(instance.user_id, following_count=-1)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_card_expire(sender, instance, **kwargs):
+    bump_version('post', instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def comment_card_expire(sender, instance, **kwargs):
+    bump_version('post', instance.post_id)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_card_expire(sender, instance, **kwargs):
+    bump_version('group', instance.pk)
+
+
+@receiver(post_save, sender=User)
+def user_card_expire(sender, instance, update_fields=None, **kwargs):
+    if update_fields != frozenset(('last_login',)):
+        bump_version('user', instance.pk)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_page_expire(sender, instance, **kwargs):
+    """Меняем версии списков, в которые входит или входило сообщение"""
+    bump_version('feed', 'all')
+    bump_version('user_feed', instance.author_id)
+    for group_id in {instance._saved_group_id, instance.group_id}:
+        if group_id is not None:
+            bump_version('group_feed', group_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_page_expire(sender, instance, **kwargs):
+    bump_version('user_feed', instance.author_id)
+    bump_version('follows', instance.user_id)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+@receiver(post_save, sender=User)
+def site_page_expire(sender, instance, update_fields=None, **kwargs):
+    """Названия групп и имена авторов видны на всех страницах"""
+    if update_fields != frozenset(('last_login',)):
+        bump_version('site', 'all')
+
+
+@receiver(post_save, sender=Post)
+def post_thumbnails(sender, instance, **kwargs):
+    """Миниатюры новой картинки готовятся в фоне, а не в запросе"""
+    if instance.image:
+        schedule_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def post_search_index(sender, instance, **kwargs):
+    index_post(instance)
+
+
+@receiver(post_delete, sender=Post)
+def post_search_unindex(sender, instance, **kwargs):
+    unindex_post(instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_search_index(sender, instance, **kwargs):
+    index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_search_unindex(sender, instance, **kwargs):
+    unindex_comment(instance.pk)
+
+
+@receiver(post_save, sender=Post)
+def post_publish(sender, instance, created, **kwargs):
+    if created:
+        data = post_event(instance)
+        transaction.on_commit(lambda: publish('post', data))
+
+
+@receiver(post_save, sender=Comment)
+def comment_publish(sender, instance, created, **kwargs):
+    if created:
+        data = comment_event(instance)
+        transaction.on_commit(lambda: publish('comment', data))
+
+
+@receiver(post_save, sender=Post)
+def post_remember_saved_group(sender, instance, **kwargs):
+    """Подключен последним: остальные обработчики видят прежние значения"""
+    instance._saved_group_id = instance.group_id
+    instance._saved_image = image_name(instance.image)
@@ -0,0 +1,12 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from posts.fragments import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_cards(posts, variant):
+    """Готовые карточки сообщений страницы из кэша карточек"""
+    return [mark_safe(card) for card in render_cards(posts, variant)]
@@ -0,0 +1,70 @@
+from django import template
+from django.conf import settings as s
+from django.utils.html import format_html
+from sorl.thumbnail import default
+
+from posts.images import variants
+from posts.kvstore import prefetch_thumbnails
+from posts.thumbnails import schedule
+
+register = template.Library()
+
+
+def srcset(thumbnails):
+    return ', '.join(
+        f'{thumbnail.url} {thumbnail.width}w' for thumbnail in thumbnails
+    )
+
+
+@register.simple_tag
+def post_image(post, css_class='card-img my-2'):
+    """Картинка сообщения с srcset из готовых вариантов.
+
+    Размеры берутся из хранилища ключей и полей сообщения, файлы
+    при отрисовке не открываются. Записи о вариантах загружаются
+    разом, если render_cards не сделал этого для всей страницы.
+    Недостающие варианты ставятся в очередь одной задачей, а пока
+    их нет, выводится оригинал.
+    """
+    if not post.image:
+        return ''
+    prefetch_thumbnails([post.image.name])
+    ready = {}
+    missing = False
+    for geometry, options in variants():
+        thumbnail = default.kvstore.get(default.backend.thumbnail_file(
+            post.image.name, geometry, options
+        ))
+        if thumbnail is None:
+            missing = True
+        else:
+            ready.setdefault(options['format'], []).append(thumbnail)
+    if missing:
+        schedule(post.image.name, variants())
+    jpeg = ready.get('JPEG')
+    if not jpeg:
+        if post.image_width and post.image_height:
+            return format_html(
+                '<img class="{}" src="{}" width="{}" height="{}" '
+                'loading="lazy">',
+                css_class, post.image.url,
+                post.image_width, post.image_height
+            )
+        return format_html(
+            '<img class="{}" src="{}" loading="lazy">',
+            css_class, post.image.url
+        )
+    largest = jpeg[-1]
+    image = format_html(
+        '<img class="{}" src="{}" srcset="{}" sizes="{}" width="{}" '
+        'height="{}" loading="lazy">',
+        css_class, largest.url, srcset(jpeg), s.POST_IMAGE_SIZES,
+        largest.width, largest.height
+    )
+    if 'WEBP' not in ready:
+        return image
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '{}</picture>',
+        srcset(ready['WEBP']), s.POST_IMAGE_SIZES, image
+    )
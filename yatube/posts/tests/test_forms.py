@@ -1,17 +1,31 @@
+import hashlib
+import os
 import shutil
 import tempfile
 from http import HTTPStatus
+from io import BytesIO
 
 from django.conf import settings as s
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase, Client, override_settings
 from django.urls import reverse
+from PIL import Image
 
-from posts.models import Post, Group, Comment
+from posts.media import collect
+from posts.models import Blob, Post, Group, Comment
+from posts.thumbnails import generate
 
 User = get_user_model()
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=s.BASE_DIR)
+SAME_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
 
 
 @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
@@ -66,16 +80,65 @@ class PostFormTests(TestCase):
             form_data,
             follow=True
         )
+        digest = hashlib.sha256(test_gif).hexdigest()
         self.assertEqual(Post.objects.count(), posts_count + 1)
         self.assertTrue(
             Post.objects.filter(
                 text=form_data['text'],
                 group=self.group,
                 author=self.user,
-                image='posts/test.gif',
+                image=f'posts/{digest[:2]}/{digest[2:4]}/{digest}.gif',
             ).exists()
         )
 
+    def test_same_image_stored_once(self):
+        """Одинаковые картинки - один файл, он удаляется с последней"""
+        for number in range(2):
+            self.authorized_client.post(reverse('posts:post_create'), {
+                'text': f'Сообщение {number}',
+                'image': SimpleUploadedFile(
+                    name=f'same_{number}.gif',
+                    content=SAME_GIF,
+                    content_type='image/gif'
+                ),
+            })
+        posts = Post.objects.filter(text__startswith='Сообщение ')
+        names = set(posts.values_list('image', flat=True))
+        self.assertEqual(len(names), 1)
+        name = names.pop()
+        self.assertEqual(Blob.objects.get(name=name).refs, 2)
+        path = os.path.join(TEMP_MEDIA_ROOT, name)
+        self.assertTrue(os.path.exists(path))
+        posts.first().delete()
+        self.assertFalse(collect(name))
+        self.assertTrue(os.path.exists(path))
+        posts.get().delete()
+        self.assertTrue(collect(name))
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.filter(name=name).exists())
+
+    def test_create_post_image_limits(self):
+        """Слишком большие картинки отклоняются до декодирования"""
+        limits = (
+            ('too_large', {'UPLOAD_MAX_BYTES': 16}),
+            ('too_many_pixels', {'UPLOAD_MAX_PIXELS': 1}),
+        )
+        for code, limit in limits:
+            with self.subTest(code=code), self.settings(**limit):
+                response = self.authorized_client.post(
+                    reverse('posts:post_create'), {
+                        'text': 'Большая картинка',
+                        'image': SimpleUploadedFile(
+                            'big.gif', SAME_GIF, 'image/gif'
+                        ),
+                    }
+                )
+                errors = response.context['form'].errors.as_data()
+                self.assertEqual(errors['image'][0].code, code)
+                self.assertFalse(
+                    Post.objects.filter(text='Большая картинка').exists()
+                )
+
     def test_create_post_unauthorized(self):
         """Пытаемся создать запись в Post"""
         form_data = {
@@ -128,6 +191,33 @@ class PostFormTests(TestCase):
             self.user
         )
 
+    def test_edit_post_image_resets_size(self):
+        """Новая картинка при правке получает свои размеры"""
+        post = Post.objects.create(
+            author=self.user,
+            text='Тестовое сообщение',
+            image=SimpleUploadedFile('same.gif', SAME_GIF, 'image/gif')
+        )
+        generate(post.image.name)
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        buffer = BytesIO()
+        Image.new('RGB', (4, 3)).save(buffer, 'PNG')
+        self.authorized_client.post(
+            reverse('posts:post_edit', kwargs={'post_id': post.pk}),
+            data={
+                'text': post.text,
+                'image': SimpleUploadedFile(
+                    'new.png', buffer.getvalue(), 'image/png'
+                ),
+            }
+        )
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (None, None))
+        generate(post.image.name)
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (4, 3))
+
 
 class CommentFormTests(PostFormTests):
     def test_comment_for_registered_users(self):
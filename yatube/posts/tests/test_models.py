@@ -1,9 +1,19 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings as s
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.test import TestCase, override_settings
 
-from posts.models import Post, Group, Comment, Follow
+from posts.models import Post, Group, Comment, Follow, UserStats, Timeline
 
 User = get_user_model()
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=s.BASE_DIR)
 
 
 class PostModelTest(TestCase):
@@ -191,3 +201,226 @@ class FollowModelTest(TestCase):
             with self.subTest(field=field):
                 self.assertEqual(
                     follow._meta.get_field(field).help_text, expected_value)
+
+
+class CountersTest(TestCase):
+    """Создаем пользователей и группы для проверки счетчиков"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='serg')
+        cls.user_another = User.objects.create_user(username='andr')
+        cls.group = Group.objects.create(title='Первая', slug='first')
+        cls.group_another = Group.objects.create(title='Вторая', slug='sec')
+
+    def stats(self, user):
+        return UserStats.objects.get(user=user)
+
+    def test_counters_follow_writes(self):
+        """Счетчики меняются при создании, правке и удалении"""
+        post = Post.objects.create(
+            author=self.user, text='Сообщение', group=self.group
+        )
+        Comment.objects.create(post=post, author=self.user, text='Ок')
+        follow = Follow.objects.create(
+            user=self.user_another, author=self.user
+        )
+        self.assertEqual(self.stats(self.user).posts_count, 1)
+        self.assertEqual(self.stats(self.user).followers_count, 1)
+        self.assertEqual(self.stats(self.user_another).following_count, 1)
+        self.assertEqual(Post.objects.get(pk=post.pk).comments_count, 1)
+        self.assertEqual(Group.objects.get(pk=self.group.pk).posts_count, 1)
+
+        post = Post.objects.get(pk=post.pk)
+        post.group = self.group_another
+        post.save()
+        self.assertEqual(Group.objects.get(pk=self.group.pk).posts_count, 0)
+        self.assertEqual(
+            Group.objects.get(pk=self.group_another.pk).posts_count, 1
+        )
+
+        follow.delete()
+        post.delete()
+        self.assertEqual(self.stats(self.user).posts_count, 0)
+        self.assertEqual(self.stats(self.user).followers_count, 0)
+        self.assertEqual(
+            Group.objects.get(pk=self.group_another.pk).posts_count, 0
+        )
+
+    def test_counters_fail_together_with_write(self):
+        """Сбой счетчика откатывает и саму запись"""
+        post = Post.objects.create(
+            author=self.user, text='Сообщение', group=self.group
+        )
+        with mock.patch(
+            'posts.signals.bump', side_effect=DatabaseError('counter')
+        ):
+            with self.assertRaises(DatabaseError):
+                Comment.objects.create(post=post, author=self.user, text='Ок')
+            with self.assertRaises(DatabaseError):
+                post.delete()
+        self.assertFalse(Comment.objects.exists())
+        self.assertTrue(Post.objects.filter(pk=post.pk).exists())
+        with mock.patch(
+            'posts.signals.bump_user', side_effect=DatabaseError('counter')
+        ):
+            with self.assertRaises(DatabaseError):
+                Follow.objects.create(user=self.user_another, author=self.user)
+        self.assertFalse(Follow.objects.exists())
+        self.assertEqual(self.stats(self.user).posts_count, 1)
+
+    def test_rebuild_counters_command(self):
+        """Команда rebuild_counters исправляет расхождения"""
+        Post.objects.create(author=self.user, text='Сообщение')
+        UserStats.objects.filter(user=self.user).update(posts_count=7)
+        UserStats.objects.filter(user=self.user_another).delete()
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(self.stats(self.user).posts_count, 1)
+        self.assertEqual(self.stats(self.user_another).posts_count, 0)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class GenerateDatasetTest(TestCase):
+    """Создаем небольшой синтетический набор данных"""
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        call_command(
+            'generate_dataset', users=20, groups=3, posts=200,
+            comments=300, follows=3, images=2, image_share=0.5, seed=1,
+            stdout=StringIO()
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_dataset_sizes_and_counters(self):
+        """Созданы все объекты, счетчики и ленты согласованы"""
+        self.assertEqual(User.objects.count(), 20)
+        self.assertEqual(Group.objects.count(), 3)
+        self.assertEqual(Post.objects.count(), 200)
+        self.assertEqual(Comment.objects.count(), 300)
+        self.assertTrue(Follow.objects.exists())
+        self.assertEqual(
+            Timeline.objects.count(),
+            Post.objects.filter(author__following__isnull=False).count()
+        )
+        self.assertEqual(UserStats.objects.count(), 20)
+        for post in Post.objects.filter(comments_count__gt=0)[:20]:
+            with self.subTest(post=post.pk):
+                created = post.comments.values_list('created', flat=True)
+                self.assertEqual(post.comments_count, len(created))
+                self.assertGreater(min(created), post.pub_date)
+
+    def test_dataset_dates_and_images(self):
+        """Даты сообщений различаются, часть сообщений с картинками"""
+        dates = Post.objects.values_list('pub_date', flat=True)
+        self.assertEqual(len(set(dates)), 200)
+        with_image = Post.objects.exclude(image='')
+        self.assertTrue(with_image.exists())
+        self.assertTrue(all(
+            post.image.storage.exists(post.image.name)
+            for post in with_image
+        ))
+
+
+class TransferTest(TestCase):
+    """Выгружаем данные и загружаем их в пустую базу"""
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='serg')
+        cls.user_another = User.objects.create_user(username='olga')
+        cls.group = Group.objects.create(
+            title='Группа', slug='test-slug', description='Описание'
+        )
+        cls.post = Post.objects.create(
+            author=cls.user, text='Первое сообщение', group=cls.group
+        )
+        Post.objects.create(author=cls.user_another, text='Второе')
+        Comment.objects.create(
+            post=cls.post, author=cls.user_another, text='Комментарий'
+        )
+        Follow.objects.create(user=cls.user_another, author=cls.user)
+
+    def snapshot(self):
+        return {
+            'groups': list(Group.objects.values_list('slug', 'title')),
+            'posts': list(Post.objects.order_by('pk').values_list(
+                'pk', 'text', 'pub_date', 'author__username', 'group__slug'
+            )),
+            'comments': list(Comment.objects.values_list(
+                'pk', 'post_id', 'author__username', 'created'
+            )),
+            'follows': list(Follow.objects.values_list(
+                'user__username', 'author__username'
+            )),
+        }
+
+    def clear(self):
+        for model in (Follow, Comment, Post, Group):
+            model.objects.all().delete()
+        User.objects.filter(username='olga').delete()
+
+    def round_trip(self, path, export_options):
+        before = self.snapshot()
+        call_command(
+            'export_data', path, stderr=StringIO(), **export_options
+        )
+        self.clear()
+        call_command('import_data', path, batch=1, stdout=StringIO())
+        self.assertEqual(self.snapshot(), before)
+        self.assertEqual(
+            Post.objects.get(pk=self.post.pk).comments_count, 1
+        )
+        self.assertTrue(Timeline.objects.filter(
+            user__username='olga', post=self.post
+        ).exists())
+        call_command('import_data', path, stdout=StringIO())
+        self.assertEqual(self.snapshot(), before)
+
+    def test_jsonl_round_trip(self):
+        """JSON Lines загружается обратно без потерь и без дублей"""
+        with tempfile.TemporaryDirectory() as directory:
+            self.round_trip(os.path.join(directory, 'dump.jsonl.gz'), {})
+
+    def test_csv_round_trip(self):
+        """CSV загружается обратно без потерь и без дублей"""
+        with tempfile.TemporaryDirectory() as directory:
+            self.round_trip(directory, {'format': 'csv'})
+
+    def test_import_into_populated_db(self):
+        """Занятый другой записью id останавливает загрузку"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dump.jsonl')
+            call_command('export_data', path, stderr=StringIO())
+            self.clear()
+            other = User.objects.create_user(username='ivan')
+            Post.objects.create(pk=self.post.pk + 100, author=other, text='1')
+            call_command('import_data', path, stdout=StringIO())
+            self.assertEqual(Post.objects.count(), 3)
+            self.assertEqual(
+                Post.objects.get(pk=self.post.pk).comments.get().text,
+                'Комментарий'
+            )
+            self.clear()
+            Post.objects.create(pk=self.post.pk, author=other, text='Чужое')
+            before = self.snapshot()
+            with self.assertRaisesMessage(ValueError, f'post {self.post.pk}'):
+                call_command('import_data', path, stdout=StringIO())
+            self.assertEqual(self.snapshot(), before)
+
+
+class SqlitePragmasTest(TestCase):
+    def test_pragmas_applied(self):
+        """Новое соединение получает PRAGMA из SQLITE_PRAGMAS"""
+        with connection.cursor() as cursor:
+            for name, expected in (
+                ('synchronous', 1), ('temp_store', 2),
+                ('busy_timeout', s.SQLITE_PRAGMAS['busy_timeout']),
+                ('cache_size', s.SQLITE_PRAGMAS['cache_size']),
+            ):
+                with self.subTest(name=name):
+                    cursor.execute(f'PRAGMA {name}')
+                    self.assertEqual(cursor.fetchone()[0], expected)
@@ -1,8 +1,11 @@
+import asyncio
 from http import HTTPStatus
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase, Client
+from django.test import SimpleTestCase, TestCase, Client
 
+from core.asgi import ASGIHandler
+from posts.events import publish
 from posts.models import Post, Group
 
 User = get_user_model()
@@ -107,3 +110,57 @@ class PostURLTests(TestCase):
                 response = role.get(url, follow=True)
                 self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
                 self.assertTemplateUsed(response, 'core/404.html')
+
+
+class AsgiHandlerTests(SimpleTestCase):
+    """Запросы через ASGIHandler без ASGI-сервера"""
+
+    def call(self, path, on_chunk=None):
+        """Сообщения ответа; on_chunk(body) True - клиент отключился"""
+        app = ASGIHandler(threads=2)
+        sent = []
+
+        async def run():
+            gone = asyncio.Event()
+            messages = [{'type': 'http.request', 'body': b''}]
+
+            async def receive():
+                if messages:
+                    return messages.pop()
+                await gone.wait()
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                body = message.get('body')
+                if body and on_chunk and on_chunk(body):
+                    gone.set()
+
+            await app({
+                'type': 'http', 'method': 'GET', 'path': path,
+                'query_string': b'', 'headers': [(b'host', b'testserver')],
+            }, receive, send)
+
+        asyncio.run(run())
+        return sent
+
+    def test_page(self):
+        """Обычная страница приходит целиком одним сообщением"""
+        start, body = self.call('/about/author/')
+        self.assertEqual(start['status'], HTTPStatus.OK)
+        self.assertIn(
+            (b'content-type', b'text/html; charset=utf-8'), start['headers']
+        )
+        self.assertIn(b'</html>', body['body'])
+
+    def test_live_stream_until_disconnect(self):
+        """Живая лента идет из цикла событий до отключения клиента"""
+        def on_chunk(body):
+            if body.startswith(b'retry: '):
+                publish('post', {'id': 0, 'author': 0, 'group': None})
+            return b'event: post' in body
+
+        sent = self.call('/live/', on_chunk)
+        self.assertEqual(sent[0]['status'], HTTPStatus.OK)
+        self.assertIn(b'event: post', sent[-2]['body'])
+        self.assertEqual(sent[-1], {'type': 'http.response.body', 'body': b''})
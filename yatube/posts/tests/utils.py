@@ -0,0 +1,48 @@
+from contextlib import ExitStack
+
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from core.middleware import query_budget
+
+
+class QueryBudgetMixin:
+    """Проверки числа SQL-запросов для тестов view"""
+
+    def assertQueryBudget(self, client, url, data=None):
+        """Ответ укладывается в QUERY_BUDGETS своего view"""
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        # Обертка, в отличие от CaptureQueriesContext, не открывает
+        # соединения с базами, которых тест не использует
+        with ExitStack() as stack:
+            for db in connections.all():
+                stack.enter_context(db.execute_wrapper(record))
+            response = client.get(url, data)
+        view_name = response.resolver_match.view_name
+        budget = query_budget(view_name)
+        self.assertLessEqual(
+            len(queries), budget,
+            f'{view_name}: {len(queries)} запросов при лимите {budget}:\n'
+            + '\n'.join(queries)
+        )
+        return response
+
+    def assertConstantQueries(self, client, url, grow, data=None):
+        """Число запросов не зависит от числа записей на странице.
+
+        grow вызывается между двумя замерами и добавляет записи.
+        """
+        with CaptureQueriesContext(connection) as before:
+            client.get(url, data)
+        grow()
+        with CaptureQueriesContext(connection) as after:
+            client.get(url, data)
+        self.assertEqual(
+            len(before), len(after),
+            f'{url}: N+1, {len(before)} -> {len(after)} запросов'
+        )
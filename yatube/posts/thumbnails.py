@@ -0,0 +1,204 @@
+"""Миниатюры картинок без обработки изображений в запросе.
+
+Тег post_image и {% thumbnail %} берут только готовые миниатюры из
+хранилища ключей sorl. Недостающие создаются в фоновом потоке, а
+шаблон пока получает оригинал. Сохранение сообщения с новой
+картинкой ставит в очередь все варианты из posts.images одной
+задачей: оригинал декодируется один раз. Когда миниатюры готовы,
+у сообщений запоминаются размеры оригинала, а версии карточек и
+страниц с этой картинкой меняются.
+"""
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings as s
+from django.db import close_old_connections, transaction
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.parsers import parse_geometry
+
+from posts.fragments import bump_version
+from posts.images import variants
+from posts.models import Post
+from posts.sharding import each
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_pending = set()
+_lock = threading.Lock()
+
+
+def task_key(name, sizes):
+    return name, tuple(
+        (geometry, tuple(sorted(options.items())))
+        for geometry, options in sizes
+    )
+
+
+def executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=s.THUMBNAIL_WORKERS,
+                thread_name_prefix='thumbnails'
+            )
+        return _executor
+
+
+def schedule(name, sizes):
+    """Ставим миниатюры в очередь после фиксации транзакции"""
+    key = task_key(name, sizes)
+
+    def submit():
+        with _lock:
+            if key in _pending:
+                return
+            _pending.add(key)
+        if s.THUMBNAIL_WORKERS:
+            executor().submit(work, key, name, sizes)
+        else:
+            work(key, name, sizes, inline=True)
+
+    transaction.on_commit(submit)
+
+
+def schedule_post(post):
+    """Все варианты картинки сообщения одной задачей"""
+    schedule(post.image.name, variants())
+
+
+def expire_image_pages(name):
+    """Меняем версии карточек и страниц с сообщениями с картинкой"""
+    posts = [
+        row for queryset in each(Post.objects.filter(image=name))
+        for row in queryset.values_list('pk', 'author_id', 'group_id')
+    ]
+    for pk, author_id, group_id in posts:
+        bump_version('post', pk)
+        bump_version('user_feed', author_id)
+        if group_id is not None:
+            bump_version('group_feed', group_id)
+    if posts:
+        bump_version('feed', 'all')
+
+
+def generate(name, sizes=None):
+    """Создаем миниатюры, запоминаем размеры оригинала у сообщений"""
+    source = default.backend.create_thumbnails(name, sizes or variants())
+    width, height = source.size
+    for posts in each(Post.objects.filter(
+        image=name, image_width__isnull=True
+    )):
+        posts.update(image_width=width, image_height=height)
+    expire_image_pages(name)
+
+
+def work(key, name, sizes, inline=False):
+    """Задача фонового потока или, при THUMBNAIL_WORKERS = 0, запроса"""
+    try:
+        generate(name, sizes)
+    except Exception:
+        logger.exception('Thumbnails for %s failed', name)
+    finally:
+        with _lock:
+            _pending.discard(key)
+        if not inline:
+            close_old_connections()
+
+
+class DeferredThumbnailBackend(ThumbnailBackend):
+    """Отдает только готовые миниатюры, остальные ставит в очередь"""
+
+    def full_options(self, source, options):
+        """Параметры с умолчаниями, как их дополняет get_thumbnail sorl"""
+        options = dict(options)
+        if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(sorl_settings, attr)
+            if value != getattr(sorl_defaults, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_file(self, file_, geometry_string, options):
+        """Файл миниатюры без обращения к хранилищам"""
+        source = ImageFile(file_)
+        return ImageFile(
+            self._get_thumbnail_filename(
+                source, geometry_string, self.full_options(source, options)
+            ),
+            default.storage
+        )
+
+    def create_thumbnails(self, file_, sizes):
+        """Недостающие миниатюры sizes за одно декодирование оригинала"""
+        source = ImageFile(file_)
+        missing = []
+        for geometry_string, options in sizes:
+            options = self.full_options(source, options)
+            thumbnail = ImageFile(
+                self._get_thumbnail_filename(source, geometry_string, options),
+                default.storage
+            )
+            if not default.kvstore.get(thumbnail):
+                missing.append((geometry_string, options, thumbnail))
+        if not missing:
+            return default.kvstore.get_or_set(source)
+        image = default.engine.get_image(source)
+        try:
+            info = default.engine.get_image_info(image)
+            width, height = default.engine.get_image_size(image)
+            if width * height > s.UPLOAD_MAX_PIXELS:
+                raise ValueError(f'{source.name}: {width}x{height} is too big')
+            source.set_size((width, height))
+            self.draft(image, missing)
+            for geometry_string, options, thumbnail in missing:
+                options['image_info'] = info
+                self._create_thumbnail(
+                    image, geometry_string, options, thumbnail
+                )
+        finally:
+            default.engine.cleanup(image)
+        source = default.kvstore.get_or_set(source)
+        for geometry_string, options, thumbnail in missing:
+            default.kvstore.set(thumbnail, source)
+        return source
+
+    def draft(self, image, missing):
+        """JPEG декодируется сразу уменьшенным, но не меньше нужного"""
+        if getattr(image, 'format', None) != 'JPEG':
+            return
+        width, height = image.size
+        rotated = image.getexif().get(0x0112, 1) in (5, 6, 7, 8)
+        if rotated:
+            width, height = height, width
+        needed_width = needed_height = 0
+        for geometry_string, options, _ in missing:
+            x, y = parse_geometry(geometry_string, width / height)
+            factor = (max if options['crop'] else min)(x / width, y / height)
+            needed_width = max(needed_width, math.ceil(width * factor))
+            needed_height = max(needed_height, math.ceil(height * factor))
+        if rotated:
+            needed_width, needed_height = needed_height, needed_width
+        image.draft(image.mode, (needed_width, needed_height))
+
+    def get_thumbnail(self, file_, geometry_string, **options):
+        if not file_:
+            raise ValueError('falsey file_ argument in get_thumbnail()')
+        source = ImageFile(file_)
+        cached = default.kvstore.get(
+            self.thumbnail_file(source, geometry_string, options)
+        )
+        if cached:
+            return cached
+        schedule(source.name, [(geometry_string, options)])
+        return source
@@ -0,0 +1,400 @@
+"""Выгрузка и загрузка групп, сообщений, комментариев и подписок.
+
+Строки читаются из базы через values_list().iterator() кусками и
+пишутся в JSON Lines (по записи на строку, поле model - ее тип) или
+в CSV (файл на тип в каталоге). Загрузка копит записи пачками по
+batch и вставляет каждую одним executemany. Пользователи и группы
+ищутся по username и slug одним запросом на пачку, найденные id
+держатся в ограниченном LRU, поэтому память не зависит от объема
+выгрузки. Сообщения и комментарии сохраняют свои id: повторная
+загрузка того же файла ничего не дублирует, а id, занятый в базе
+другой записью (иной автор или дата), останавливает загрузку целиком:
+иначе запись молча пропала бы, а ее комментарии достались бы чужому
+сообщению. Счетчики, ленты, ссылки
+на картинки и поисковый индекс после загрузки пересчитываются
+целиком. Строки пишутся прямо в default, поэтому при SHARDS выгрузка
+и загрузка не запускаются.
+"""
+import csv
+import gzip
+import json
+import os
+import sys
+from collections import OrderedDict
+from contextlib import nullcontext
+from datetime import datetime
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+
+from posts.dataset import rebuild_derived
+from posts.fragments import bump_version
+from posts.models import Post, Group, User, Comment, Follow
+from posts.sharding import unsharded
+
+MODELS = ('group', 'post', 'comment', 'follow')
+FIELDS = {
+    'group': (Group, {
+        'slug': 'slug',
+        'title': 'title',
+        'description': 'description',
+    }),
+    'post': (Post, {
+        'id': 'id',
+        'text': 'text',
+        'pub_date': 'pub_date',
+        'author': 'author__username',
+        'group': 'group__slug',
+        'image': 'image',
+    }),
+    'comment': (Comment, {
+        'id': 'id',
+        'post': 'post_id',
+        'author': 'author__username',
+        'text': 'text',
+        'created': 'created',
+    }),
+    'follow': (Follow, {
+        'user': 'user__username',
+        'author': 'author__username',
+    }),
+}
+# Поля, по которым строка с тем же id считается той же записью
+IDENTITY = {
+    'post': ('author_id', 'pub_date'),
+    'comment': ('post_id', 'author_id', 'created'),
+}
+# Запас до предела SQLite в 999 параметров запроса
+LOOKUP_CHUNK = 500
+
+
+def chunks(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def open_text(path, mode):
+    """Файл, gzip по расширению .gz или stdin/stdout для '-'"""
+    if path == '-':
+        return nullcontext(sys.stdin if mode == 'r' else sys.stdout)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not serializable')
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def export_rows(name, chunk=2000):
+    """Записи одного типа в порядке id, кусками по chunk строк"""
+    model, fields = FIELDS[name]
+    rows = model.objects.order_by('pk').values_list(*fields.values())
+    for row in rows.iterator(chunk_size=chunk):
+        yield dict(zip(fields, row))
+
+
+def write_jsonl(file, models=MODELS, chunk=2000):
+    """Выгружаем models в JSON Lines, возвращаем число записей по типам"""
+    unsharded('export')
+    counts = {}
+    for name in models:
+        counts[name] = 0
+        for row in export_rows(name, chunk):
+            row = {'model': name, **row}
+            file.write(json.dumps(row, ensure_ascii=False, default=encode))
+            file.write('\n')
+            counts[name] += 1
+    return counts
+
+
+def write_csv(directory, models=MODELS, chunk=2000):
+    """Выгружаем models в каталог, по файлу <тип>.csv на тип"""
+    unsharded('export')
+    os.makedirs(directory, exist_ok=True)
+    counts = {}
+    for name in models:
+        counts[name] = 0
+        path = os.path.join(directory, f'{name}.csv')
+        with open_text(path, 'w') as file:
+            writer = csv.DictWriter(file, fieldnames=FIELDS[name][1])
+            writer.writeheader()
+            for row in export_rows(name, chunk):
+                writer.writerow({
+                    key: csv_value(value) for key, value in row.items()
+                })
+                counts[name] += 1
+    return counts
+
+
+def read_jsonl(file):
+    """Пары (тип, запись) из JSON Lines"""
+    for line in file:
+        if line.strip():
+            record = json.loads(line)
+            yield record.pop('model'), record
+
+
+def read_csv(directory):
+    """Пары (тип, запись) из файлов каталога в порядке MODELS"""
+    for name in MODELS:
+        path = os.path.join(directory, f'{name}.csv')
+        if not os.path.exists(path):
+            continue
+        with open_text(path, 'r') as file:
+            for row in csv.DictReader(file):
+                yield name, {
+                    key: value if value != '' else None
+                    for key, value in row.items()
+                }
+
+
+class Resolver:
+    """Натуральный ключ -> id пачками, с ограниченным LRU"""
+
+    def __init__(self, model, field, make=None, size=100000):
+        self.model = model
+        self.field = field
+        self.make = make
+        self.size = size
+        self.cache = OrderedDict()
+
+    def remember(self, key, pk):
+        self.cache[key] = pk
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+
+    def lookup(self, keys):
+        found = {}
+        for chunk in chunks(keys, LOOKUP_CHUNK):
+            found.update(self.model.objects.filter(
+                **{f'{self.field}__in': chunk}
+            ).values_list(self.field, 'pk'))
+        return found
+
+    def resolve(self, keys):
+        """id для keys; без make отсутствующие ключи пропускаются"""
+        result = {}
+        missing = set()
+        for key in set(keys) - {None}:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                result[key] = self.cache[key]
+            else:
+                missing.add(key)
+        if missing:
+            found = self.lookup(missing)
+            absent = missing - set(found)
+            if absent and self.make is not None:
+                self.model.objects.bulk_create(
+                    (self.make(key) for key in absent),
+                    ignore_conflicts=True
+                )
+                found.update(self.lookup(absent))
+            for key, pk in found.items():
+                self.remember(key, pk)
+            result.update(found)
+        return result
+
+
+def check_ids(name, rows):
+    """ValueError, если id строки занят в базе другой записью"""
+    model = FIELDS[name][0]
+    fields = IDENTITY[name]
+    for chunk in chunks(rows, LOOKUP_CHUNK):
+        existing = {
+            pk: values for pk, *values in model.objects.filter(
+                pk__in=[row['id'] for row in chunk]
+            ).values_list('pk', *fields)
+        }
+        for row in chunk:
+            values = existing.get(row['id'])
+            if values is not None and values != [row[f] for f in fields]:
+                raise ValueError(
+                    f'{name} {row["id"]} already exists with other '
+                    f'{", ".join(fields)}: import into an empty database'
+                )
+
+
+def insert(model, rows):
+    """Вставка пачки словарей по attname одним executemany.
+
+    Как bulk_create(ignore_conflicts=True), но без компиляции
+    каждого значения через ORM: поля без значения получают default,
+    даты приводятся к виду базы один раз на значение.
+    """
+    fields = [
+        field for field in model._meta.concrete_fields
+        if not (field.primary_key and field.attname not in rows[0])
+    ]
+    defaults = {field.attname: field.get_default() for field in fields}
+    dates = [
+        field.attname for field in fields
+        if field.get_internal_type() == 'DateTimeField'
+    ]
+    quote = connection.ops.quote_name
+    sql = (
+        f'{connection.ops.insert_statement(ignore_conflicts=True)} '
+        f'{quote(model._meta.db_table)} '
+        f'({", ".join(quote(field.column) for field in fields)}) '
+        f'VALUES ({", ".join(["%s"] * len(fields))}) '
+        f'{connection.ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}'
+    )
+    for row in rows:
+        for name in dates:
+            row[name] = connection.ops.adapt_datetimefield_value(row[name])
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [row.get(field.attname, defaults[field.attname])
+             for field in fields]
+            for row in rows
+        ])
+
+
+class Loader:
+    """Копит записи по типам и вставляет их пачками.
+
+    Перед пачкой одного типа вставляются накопленные записи типов,
+    на которые она ссылается: группы раньше сообщений, сообщения
+    раньше комментариев.
+    """
+
+    def __init__(self, batch=5000):
+        self.batch = batch
+        password = make_password(None)
+        self.users = Resolver(
+            User, 'username',
+            make=lambda username: User(username=username, password=password),
+            size=max(100000, batch * 2)
+        )
+        self.groups = Resolver(Group, 'slug', size=max(100000, batch))
+        self.pending = {name: [] for name in MODELS}
+        self.read = dict.fromkeys(MODELS, 0)
+        self.skipped = dict.fromkeys(MODELS, 0)
+
+    def add(self, name, record):
+        if name not in self.pending:
+            raise ValueError(f'Unknown record type: {name}')
+        self.read[name] += 1
+        self.pending[name].append(record)
+        if len(self.pending[name]) >= self.batch:
+            self.flush(name)
+
+    def flush(self, last=MODELS[-1]):
+        for name in MODELS[:MODELS.index(last) + 1]:
+            records = self.pending[name]
+            if records:
+                self.pending[name] = []
+                rows = list(getattr(self, f'build_{name}s')(records))
+                if name in IDENTITY:
+                    check_ids(name, rows)
+                insert(FIELDS[name][0], rows)
+                self.skipped[name] += len(records) - len(rows)
+
+    def build_groups(self, records):
+        for record in records:
+            yield dict(
+                slug=record['slug'],
+                title=record['title'],
+                description=record['description'] or '',
+            )
+
+    def build_posts(self, records):
+        users = self.users.resolve(record['author'] for record in records)
+        groups = self.groups.resolve(record['group'] for record in records)
+        for record in records:
+            yield dict(
+                id=int(record['id']),
+                text=record['text'],
+                pub_date=parse_datetime(record['pub_date']),
+                author_id=users[record['author']],
+                group_id=groups.get(record['group']),
+                image=record['image'] or '',
+            )
+
+    def build_comments(self, records):
+        users = self.users.resolve(record['author'] for record in records)
+        posts = set()
+        for chunk in chunks(
+            {int(record['post']) for record in records}, LOOKUP_CHUNK
+        ):
+            posts.update(Post.objects.filter(pk__in=chunk).values_list(
+                'pk', flat=True
+            ))
+        for record in records:
+            if int(record['post']) in posts:
+                yield dict(
+                    id=int(record['id']),
+                    post_id=int(record['post']),
+                    author_id=users[record['author']],
+                    text=record['text'],
+                    created=parse_datetime(record['created']),
+                )
+
+    def build_follows(self, records):
+        users = self.users.resolve(
+            username
+            for record in records
+            for username in (record['user'], record['author'])
+        )
+        for record in records:
+            if record['user'] != record['author']:
+                yield dict(
+                    user_id=users[record['user']],
+                    author_id=users[record['author']],
+                )
+
+
+def load(records, batch=5000, timelines=True, log=None):
+    """Загружаем пары (тип, запись), возвращаем счетчики по типам.
+
+    read - прочитано, added - новых строк в базе, skipped -
+    комментарии к отсутствующим сообщениям и подписки на себя.
+    Записи, которые уже есть в базе, не добавляются повторно, чужой
+    id дает ValueError и откат всей загрузки.
+    """
+    unsharded('import')
+    log = log or (lambda message: None)
+    loader = Loader(batch)
+    models = {name: FIELDS[name][0] for name in MODELS}
+    with transaction.atomic():
+        before = {
+            name: model.objects.count() for name, model in models.items()
+        }
+        for number, (name, record) in enumerate(records, 1):
+            loader.add(name, record)
+            if number % (batch * 20) == 0:
+                log(f'read: {number}')
+        loader.flush()
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                no_style(), list(models.values())
+            ):
+                cursor.execute(sql)
+        added = {
+            name: model.objects.count() - before[name]
+            for name, model in models.items()
+        }
+        log(f'added: {added}, skipped: {loader.skipped}')
+        rebuild_derived(timelines, log)
+    bump_version('feed', 'all')
+    bump_version('site', 'all')
+    return {'read': loader.read, 'added': added, 'skipped': loader.skipped}
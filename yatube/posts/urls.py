@@ -1,6 +1,6 @@
 from django.urls import path
 
-from posts import views
+from posts import api, views
 
 app_name = 'posts'
 
@@ -12,7 +12,14 @@ urlpatterns = [
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path('posts/<int:post_id>/comment/', views.add_comment, name='ad_comment'),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'
+    ),
     path('follow/', views.follow_index, name='follow_index'),
+    path('search/', views.search, name='search'),
+    path('live/', views.live, name='live'),
     path(
         'profile/<str:username>/follow/',
         views.profile_follow,
@@ -23,4 +30,29 @@ urlpatterns = [
         views.profile_unfollow,
         name='profile_unfollow'
     ),
+    path('api/v1/posts/', api.posts_api, name='api_posts'),
+    path('api/v1/posts/<int:post_id>/', api.post_api, name='api_post'),
+    path(
+        'api/v1/posts/<int:post_id>/comments/',
+        api.comments_api,
+        name='api_comments'
+    ),
+    path('api/v1/groups/', api.groups_api, name='api_groups'),
+    path('api/v1/groups/<slug:slug>/', api.group_api, name='api_group'),
+    path(
+        'api/v1/groups/<slug:slug>/posts/',
+        api.group_posts_api,
+        name='api_group_posts'
+    ),
+    path(
+        'api/v1/users/<str:username>/posts/',
+        api.user_posts_api,
+        name='api_user_posts'
+    ),
+    path('api/v1/follows/', api.follows_api, name='api_follows'),
+    path(
+        'api/v1/follows/<str:username>/',
+        api.follow_api,
+        name='api_follow'
+    ),
 ]
@@ -1,30 +1,40 @@
 from django.conf import settings as s
 from django.contrib.auth.decorators import login_required
-from django.core.paginator import Paginator
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
 
+from core.asgi import ASGI
+from posts.conditional import (
+    conditional_page, group_versions, index_versions, post_versions,
+    profile_versions
+)
+from posts.counters import user_stats
+from posts.events import astream, parse_id, stream
 from posts.forms import PostForm, CommentForm
-from posts.models import Post, Group, User, Comment, Follow
+from posts.models import Post, Group, User, Follow, Timeline
+from posts.paginators import cached_count, paginate
+from posts.search import search as search_posts
+from posts.sharding import for_authors, get_or_404, scatter, sharded
 
 
+@conditional_page(index_versions)
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, s.NUMBER_MESSAGES)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = scatter(Post.objects.select_related('author', 'group'))
+    page_obj = paginate(
+        request, post_list, total=cached_count('index', post_list)
+    )
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/index.html', context)
 
 
+@conditional_page(group_versions)
 def group_posts(request, slug):
     template = 'posts/group_list.html'
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, s.NUMBER_MESSAGES)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    post_list = scatter(group.posts.select_related('author', 'group'))
+    page_obj = paginate(request, post_list, total=group.posts_count)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -32,13 +42,16 @@ def group_posts(request, slug):
     return render(request, template, context)
 
 
+@conditional_page(profile_versions)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    count = post_list.count()
-    paginator = Paginator(post_list, s.NUMBER_MESSAGES)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    author = get_object_or_404(
+        User.objects.select_related('stats'),
+        username=username
+    )
+    stats = user_stats(author)
+    post_list = scatter(author.posts.select_related('author', 'group'))
+    count = stats.posts_count
+    page_obj = paginate(request, post_list, total=count)
     template = 'posts/profile.html'
     following = False
     if request.user.is_authenticated and Follow.objects.filter(
@@ -48,6 +61,7 @@ def profile(request, username):
         following = True
     context = {
         'author': author,
+        'stats': stats,
         'count': count,
         'following': following,
         'page_obj': page_obj,
@@ -55,12 +69,21 @@ def profile(request, username):
     return render(request, template, context)
 
 
+@conditional_page(post_versions)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_or_404(
+        Post.objects.select_related('author__stats', 'group'), post_id
+    )
     template = 'posts/post_detail.html'
-    count = post.author.posts.count()
+    count = user_stats(post.author).posts_count
     form = CommentForm(request.POST or None)
-    comments = Comment.objects.select_related('post')
+    comments = paginate(
+        request,
+        scatter(post.comments.select_related('author')),
+        key='created',
+        total=post.comments_count,
+        per_page=s.NUMBER_COMMENTS
+    )
     context = {
         'post': post,
         'count': count,
@@ -71,6 +94,82 @@ def post_detail(request, post_id):
     return render(request, template, context)
 
 
+def post_comments(request, post_id):
+    """Следующая порция комментариев для кнопки «Показать еще»"""
+    post = get_or_404(Post.objects.all(), post_id)
+    comments = paginate(
+        request,
+        scatter(post.comments.select_related('author')),
+        key='created',
+        per_page=s.NUMBER_COMMENTS
+    )
+    context = {
+        'post': post,
+        'comments': comments,
+    }
+    return render(request, 'includes/comments.html', context)
+
+
+def search(request):
+    """Поиск по тексту сообщений и комментариев"""
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'page_obj': search_posts(query, request.GET.get('cursor')),
+    }
+    return render(request, 'posts/search.html', context)
+
+
+def live(request):
+    """Поток SSE о новых сообщениях или о комментариях к ?post=.
+
+    ?follow=1 оставляет сообщения авторов из подписок на момент
+    подключения, ?group=slug - сообщения группы. Ответ 204 говорит
+    браузеру не переподключаться; так отвечаем и под WSGI, где поток
+    занял бы поток сервера.
+    """
+    if not request.META.get(ASGI):
+        return HttpResponse(status=204)
+    post_id = group_id = authors = None
+    if request.GET.get('post'):
+        if not request.GET['post'].isdigit():
+            raise Http404
+        post_id = get_or_404(
+            Post.objects.only('pk'), int(request.GET['post'])
+        ).pk
+    if request.GET.get('group'):
+        group_id = get_object_or_404(
+            Group.objects.only('pk'), slug=request.GET['group']
+        ).pk
+    if request.GET.get('follow'):
+        if not request.user.is_authenticated:
+            return HttpResponse(status=204)
+        authors = set(Follow.objects.filter(user=request.user).values_list(
+            'author_id', flat=True
+        ))
+
+    def accept(kind, data):
+        if post_id is not None:
+            return kind == 'comment' and data['post'] == post_id
+        return kind == 'post' and (
+            (group_id is None or data['group'] == group_id)
+            and (authors is None or data['author'] in authors)
+        )
+
+    last_id = parse_id(request.META.get(
+        'HTTP_LAST_EVENT_ID', request.GET.get('last_id', '')
+    ))
+    response = StreamingHttpResponse(
+        stream(accept, last_id), content_type='text/event-stream'
+    )
+    # Под ASGI поток отдается из цикла событий, см. core.asgi
+    response.async_content = lambda: astream(accept, last_id)
+    response['Cache-Control'] = 'no-cache'
+    # Иначе nginx копит поток в буфере
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @login_required
 def post_create(request):
     template = 'posts/create_post.html'
@@ -96,7 +195,7 @@ def post_create(request):
 @login_required
 def post_edit(request, post_id):
     template = 'posts/create_post.html'
-    post = get_object_or_404(Post, id=post_id)
+    post = get_or_404(Post.objects.all(), post_id)
 
     if request.user != post.author:
         return redirect('posts:post_detail', post_id)
@@ -124,7 +223,7 @@ def post_edit(request, post_id):
 
 @login_required
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_or_404(Post.objects.all(), post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -138,11 +237,27 @@ def add_comment(request, post_id):
 def follow_index(request):
     """Cтраница с подписками"""
     template = 'posts/follow.html'
-    page_number = request.GET.get('page')
-    posts = Post.objects.select_related('author', 'group').filter(
-        author__following__user=request.user)
+    if sharded(Post):
+        # Лент на шардах нет: сообщения авторов сливаются с шардов
+        page_obj = paginate(request, for_authors(
+            Post.objects.select_related('author', 'group'),
+            Follow.objects.filter(user=request.user).values_list(
+                'author_id', flat=True
+            )
+        ))
+    else:
+        # Страница листается по ленте: порядок (pub_date, post_id)
+        # дает индекс timeline_user_date_idx без сортировки
+        page_obj = paginate(
+            request,
+            Timeline.objects.filter(user=request.user).select_related(
+                'post__author', 'post__group'
+            ),
+            tie='post_id'
+        )
+        page_obj.object_list = [line.post for line in page_obj]
     context = {
-        'page_obj': Paginator(posts, s.NUMBER_MESSAGES).get_page(page_number),
+        'page_obj': page_obj,
     }
     return render(request, template, context)
 
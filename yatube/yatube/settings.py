@@ -38,6 +38,8 @@ INSTALLED_APPS = [
 ] 
  
 MIDDLEWARE = [ 
+    'core.middleware.QueryBudgetMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware', 
     'django.contrib.sessions.middleware.SessionMiddleware', 
     'django.middleware.common.CommonMiddleware', 
@@ -61,12 +63,14 @@ TEMPLATES = [
                 'django.contrib.auth.context_processors.auth', 
                 'django.contrib.messages.context_processors.messages', 
                 'core.context_processors.year.year', 
+                'core.context_processors.live.live',
             ], 
         }, 
     }, 
 ] 
  
 WSGI_APPLICATION = 'yatube.wsgi.application' 
+ASGI_APPLICATION = 'yatube.asgi.application'
  
  
 # Database 
@@ -136,3 +140,177 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails') 
  
 NUMBER_MESSAGES = 10
+
+TIMELINE_LENGTH = 500
+
+PAGINATOR_COUNT_TIMEOUT = 300
+# Сколько страниц вперед показывать в ссылках перелистывателя
+PAGINATOR_WINDOW = 2
+
+NUMBER_COMMENTS = 20
+
+# (view, метод): лимит SQL-запросов, HEAD считается как GET
+QUERY_BUDGETS = {
+    ('posts:index', 'GET'): 5,
+    ('posts:post_group', 'GET'): 6,
+    ('posts:profile', 'GET'): 7,
+    ('posts:post_detail', 'GET'): 6,
+    ('posts:post_comments', 'GET'): 2,
+    ('posts:follow_index', 'GET'): 4,
+    ('posts:api_posts', 'GET'): 3,
+    ('posts:api_post', 'GET'): 4,
+    ('posts:api_comments', 'GET'): 5,
+    ('posts:api_groups', 'GET'): 3,
+    ('posts:api_group', 'GET'): 4,
+    ('posts:api_group_posts', 'GET'): 5,
+    ('posts:api_user_posts', 'GET'): 5,
+    ('posts:api_follows', 'GET'): 3,
+    ('posts:api_posts', 'POST'): 11,
+    ('posts:api_post', 'PATCH'): 8,
+    ('posts:api_post', 'DELETE'): 14,
+    ('posts:api_comments', 'POST'): 8,
+    ('posts:api_follows', 'POST'): 14,
+    ('posts:api_follow', 'DELETE'): 7,
+}
+# С SHARDS: (постоянная часть, доля каждого шарда из SHARDS). Списки
+# читают страницу с каждого шарда, поиск по id обходит шарды до
+# находки, запись ищет шард автора и берет id из последовательности
+QUERY_BUDGET_SHARDS = {
+    ('posts:index', 'GET'): (3, 2),
+    ('posts:profile', 'GET'): (8, 0),
+    ('posts:post_detail', 'GET'): (6, 2),
+    ('posts:follow_index', 'GET'): (5, 1),
+    ('posts:api_posts', 'GET'): (3, 1),
+    ('posts:api_post', 'GET'): (3, 2),
+    ('posts:api_comments', 'GET'): (4, 2),
+    ('posts:api_user_posts', 'GET'): (8, 0),
+    ('posts:api_posts', 'POST'): (16, 0),
+    ('posts:api_comments', 'POST'): (12, 2),
+}
+QUERY_BUDGET_DEFAULT = 20
+QUERY_BUDGET_RAISE = False
+REQUEST_TIME_BUDGET = 1.0
+
+# Версии страниц и карточек лежат в кэше default (CACHES). Без CACHES
+# это LocMemCache одного процесса: карточки работают, а ETag и
+# Last-Modified страниц не выдаются. С общим кэшем (Memcached, Redis,
+# база) их можно сверять в любом процессе
+POST_CARD_TIMEOUT = 60 * 60 * 6
+
+THUMBNAIL_BACKEND = 'posts.thumbnails.DeferredThumbnailBackend'
+THUMBNAIL_KVSTORE = 'posts.kvstore.LRUKVStore'
+THUMBNAIL_LRU_SIZE = 10000
+# Сколько секунд помнить, что миниатюры еще нет
+THUMBNAIL_MISS_TIMEOUT = 10
+# 0 - миниатюры создаются сразу после фиксации транзакции
+THUMBNAIL_WORKERS = 2
+POST_IMAGE_CROP = (960, 339)
+POST_IMAGE_WIDTHS = (320, 640, 960)
+POST_IMAGE_SIZES = (
+    '(min-width: 1200px) 825px, (min-width: 992px) 690px, '
+    '(min-width: 768px) 510px, 100vw'
+)
+
+DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
+# Миниатюры sorl называет сам, переименование по хешу им не нужно
+THUMBNAIL_STORAGE = 'django.core.files.storage.FileSystemStorage'
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+FILE_UPLOAD_HANDLERS = ('core.uploads.StreamingUploadHandler',)
+UPLOAD_MAX_BYTES = 10 * 2 ** 20
+UPLOAD_MAX_PIXELS = 40 * 10 ** 6
+
+SEARCH_MAX_TERMS = 8
+
+API_MAX_LIMIT = 100
+
+# posts.events.CacheBroker - для нескольких процессов с общим кэшем
+EVENTS_BROKER = 'posts.events.LocalBroker'
+EVENTS_BUFFER = 1000
+EVENTS_QUEUE_SIZE = 100
+EVENTS_HEARTBEAT = 15
+# Поток живет не дольше EVENTS_MAX_AGE секунд и занимает поток
+# веб-сервера, браузер переподключается через EVENTS_RETRY мс
+EVENTS_MAX_AGE = 300
+EVENTS_RETRY = 3000
+EVENTS_POLL_INTERVAL = 1.0
+EVENTS_CACHE_TIMEOUT = 600
+
+# Потоки для view под ASGI и очередь запросов, сверх которой - 503
+ASGI_THREADS = 8
+ASGI_MAX_PENDING = 256
+
+# PRAGMA новых соединений SQLite, см. core.sqlite. busy_timeout - в
+# мс и первым, чтобы переход в WAL тоже ждал блокировку; cache_size
+# меньше нуля - в КБ
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 2 ** 20,
+    'cache_size': -64 * 2 ** 10,
+    'temp_store': 'MEMORY',
+}
+
+# Реплики только для чтения, см. core.routers. Локально это копии
+# файла базы: YATUBE_REPLICAS=2 добавляет replica1 и replica2, а
+# manage.py sync_replicas копирует в них default
+DATABASE_REPLICAS = [
+    f'replica{number}'
+    for number in range(1, int(os.environ.get('YATUBE_REPLICAS', 0)) + 1)
+]
+for alias in DATABASE_REPLICAS:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'db.{alias}.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = [
+    'posts.sharding.ShardRouter',
+    'core.routers.ReplicaRouter',
+]
+DATABASE_REPLICA_VIEWS = (
+    'posts:index',
+    'posts:post_group',
+    'posts:profile',
+    'posts:post_detail',
+    'posts:follow_index',
+)
+# После записи браузер столько секунд читает из default
+DATABASE_PIN_COOKIE = 'db_pin'
+DATABASE_PIN_SECONDS = 5
+# Реплика для тестов: зеркало default, в тестах это та же база
+REPLICA_TEST_DATABASES = ['test_replica']
+for alias in REPLICA_TEST_DATABASES:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+        'TEST': {'MIRROR': 'default'},
+    }
+
+# Шарды сообщений и комментариев по автору, см. posts.sharding.
+# YATUBE_SHARDS=3 добавляет файлы SQLite shard1..shard3; после
+# migrate --database для каждого rebalance_shards --from-default
+# переносит в них сообщения из default
+SHARDS = [
+    f'shard{number}'
+    for number in range(1, int(os.environ.get('YATUBE_SHARDS', 0)) + 1)
+]
+for alias in SHARDS:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'db.{alias}.sqlite3'),
+        # Авторы и группы в default, ссылки на них шард не проверит
+        'PRAGMAS': {'foreign_keys': 'OFF'},
+    }
+# Базы для тестов шардов: в памяти, создаются только для тестов,
+# которые их перечисляют в databases
+SHARD_TEST_DATABASES = ['test_shard1', 'test_shard2']
+for alias in SHARD_TEST_DATABASES:
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+        'PRAGMAS': {'foreign_keys': 'OFF'},
+    }
+# Id на шарде - номер * SHARD_ID_STRIDE + номер шарда с 1
+SHARD_ID_STRIDE = 1024
@@ -0,0 +1,6 @@
+"""Настройки для pytest: tests/ проверяют запросы с фиксацией транзакций"""
+from yatube.settings import *  # noqa: F401,F403
+
+# Миниатюры создаются сразу после фиксации: фоновый поток писал бы
+# в базу и MEDIA_ROOT уже после конца теста
+THUMBNAIL_WORKERS = 0